@@ -0,0 +1,192 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import heapq
+import json
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.conforming_limits import compute_loan_amount, get_conforming_limits
+from app.schemas import LoanProduct, LockPeriodRanking, MortgageCriteria, RankedLoanProduct
+from app.tokens import compact_json, tabulate_records
+
+
+# 贷款产品数据文件路径
+LOAN_PRODUCTS_FILE = Path(__file__).parent.parent / "data" / "loan_products.json"
+
+
+class LoanCatalog:
+    """
+    预加载的贷款产品目录
+
+    启动时一次性读取并校验产品数据,同时构建按 (program, balance_bucket) 的索引,
+    以及 /chat 提示词中使用的产品 JSON 文本,请求处理时不再读取文件。
+    """
+
+    def __init__(self, products_data: List[dict]):
+        self.products: List[LoanProduct] = [LoanProduct(**product) for product in products_data]
+
+        # (program, balance_bucket) -> [(原始位置, 产品)],合并多个分类时按原始位置恢复顺序
+        self.by_program_bucket: Dict[Tuple[str, str], List[Tuple[int, LoanProduct]]] = {}
+        for position, product in enumerate(self.products):
+            key = (product.program, product.balance_bucket)
+            self.by_program_bucket.setdefault(key, []).append((position, product))
+
+        # 预先渲染给大模型的产品数据,开启压缩时使用表格形式的紧凑 JSON
+        if settings.prompt_compaction:
+            self.products_json = compact_json(tabulate_records(products_data))
+        else:
+            self.products_json = json.dumps(products_data, ensure_ascii=False, indent=2)
+
+        # 目录版本号: 产品数据内容的哈希,数据不变时提示词中的目录块完全相同
+        self.version = hashlib.sha256(self.products_json.encode("utf-8")).hexdigest()[:12]
+
+    @classmethod
+    def load(cls, data_file: Path = LOAN_PRODUCTS_FILE) -> "LoanCatalog":
+        """
+        从数据文件加载产品目录(阻塞 I/O,应在线程池中调用)
+
+        Raises:
+            FileNotFoundError: 数据文件不存在
+            json.JSONDecodeError: 数据文件格式错误
+        """
+        if not data_file.exists():
+            raise FileNotFoundError(f"贷款产品数据不存在: {data_file}")
+
+        with open(data_file, 'r', encoding='utf-8') as f:
+            products_data = json.load(f)
+
+        # 额度表在同一个线程中加载,避免首次筛选时在事件循环上读取文件
+        get_conforming_limits()
+
+        return cls(products_data)
+
+    def candidates(self, filters: Optional[MortgageCriteria]) -> List[LoanProduct]:
+        """
+        根据贷款金额通过索引缩小候选产品范围
+
+        Args:
+            filters: 筛选条件
+
+        Returns:
+            贷款金额已知时返回各贷款项目对应额度分类的产品(保持原始顺序),否则返回全部产品
+        """
+        if filters is None:
+            return self.products
+
+        loan_amount = compute_loan_amount(filters.purchasePrice, filters.downPayment)
+        if loan_amount is None:
+            return self.products
+
+        limits = get_conforming_limits()
+        eligible = [
+            entries
+            for (program, bucket), entries in self.by_program_bucket.items()
+            if limits.balance_bucket(loan_amount, filters.zipCode, program) == bucket
+        ]
+        return [product for _, product in heapq.merge(*eligible)]
+
+
+# 支持的锁定期(天)
+LOCK_PERIODS = (15, 30, 45)
+
+# 计算有效成本时默认的持有年限(大部分贷款在 5 年内再融资或出售)
+DEFAULT_COST_HORIZON_YEARS = 5
+
+
+def product_identity(product: LoanProduct) -> Tuple:
+    """
+    产品去重键(不含 lender 和利率),用于合并不同贷款机构、不同利率档位的相同产品
+
+    有效成本已经包含利率,同一产品只保留成本最低的利率档位和 lender。
+    """
+    return (
+        product.name,
+        product.program,
+        product.tier,
+        product.balance_bucket,
+        product.construction_type,
+        product.arm_or_fixed,
+        product.term,
+    )
+
+
+def rank_best_products(
+    products: List[LoanProduct],
+    loan_amount: Optional[float],
+    top_k: int,
+    horizon_years: int = DEFAULT_COST_HORIZON_YEARS
+) -> List[LockPeriodRanking]:
+    """
+    按锁定期选出有效成本最低的 top-K 产品
+
+    有效成本(点数) = 锁定期价格点数 + 利率 × 持有年限,
+    提供贷款金额时换算为美元。相同产品(不同 lender 或利率档位)只保留成本最低的一个,
+    之后使用堆做部分选择,避免对整个产品集合排序。
+
+    Args:
+        products: 已筛选的贷款产品列表
+        loan_amount: 贷款金额,可为 None
+        top_k: 每个锁定期返回的产品数量
+        horizon_years: 计算利息成本的持有年限
+
+    Returns:
+        各锁定期的排名结果
+    """
+    rankings = []
+
+    for lock_days in LOCK_PERIODS:
+        price_attr = f"price_{lock_days}_day"
+
+        # 按产品去重,保留成本最低的 lender
+        cheapest: Dict[Tuple, Tuple[float, float, LoanProduct]] = {}
+        for product in products:
+            price = getattr(product, price_attr)
+            cost_points = price + product.rate * horizon_years
+            key = product_identity(product)
+            current = cheapest.get(key)
+            if current is None or cost_points < current[0]:
+                cheapest[key] = (cost_points, price, product)
+
+        top = heapq.nsmallest(top_k, cheapest.values(), key=lambda item: item[0])
+
+        rankings.append(LockPeriodRanking(
+            lockDays=lock_days,
+            products=[
+                RankedLoanProduct(
+                    product=product,
+                    price=price,
+                    effectiveCost=(
+                        round(loan_amount * cost_points / 100, 2)
+                        if loan_amount is not None else None
+                    )
+                )
+                for cost_points, price, product in top
+            ]
+        ))
+
+    return rankings
+
+
+_catalog: Optional[LoanCatalog] = None
+
+
+async def get_catalog() -> LoanCatalog:
+    """
+    获取产品目录
+
+    正常情况下目录已在应用启动阶段加载;未经过启动阶段时
+    (例如测试中直接使用应用)会在线程池中加载一次。
+    """
+    global _catalog
+    if _catalog is None:
+        _catalog = await run_in_threadpool(LoanCatalog.load)
+    return _catalog
+
+
+async def preload_catalog() -> LoanCatalog:
+    """在线程池中重新加载产品目录并替换当前目录"""
+    global _catalog
+    _catalog = await run_in_threadpool(LoanCatalog.load)
+    return _catalog
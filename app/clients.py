@@ -0,0 +1,52 @@
+from functools import lru_cache
+from typing import FrozenSet
+import hashlib
+
+from fastapi import Request
+
+from app.config import settings
+
+
+# 客户端通过该请求头传入 API Key
+API_KEY_HEADER = "X-API-Key"
+
+
+def hash_api_key(api_key: str) -> str:
+    """计算 API Key 的 SHA-256 摘要(配置和限流键中只出现摘要,不保存明文)"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=4)
+def _parse_api_key_hashes(value: str) -> FrozenSet[str]:
+    return frozenset(item.strip().lower() for item in value.split(",") if item.strip())
+
+
+def get_client_id(request: Request) -> str:
+    """
+    识别请求来源的客户端
+
+    只有摘要在 API_KEY_HASHES 允许列表中的 API Key 才按 Key 识别;未知的 Key 与没有 Key
+    一样按客户端 IP 识别,避免通过轮换请求头绕过限流。
+
+    部署在反向代理之后时开启 TRUST_PROXY_HEADERS。X-Forwarded-For 左侧的地址由客户端提供,
+    可以任意伪造;每层代理会在末尾追加它看到的地址,因此从右往左数第 TRUSTED_PROXY_HOPS 个地址
+    是最外层代理看到的真实客户端地址。地址数量不足时按连接地址识别。
+
+    Returns:
+        "key:<api key 摘要>" 或 "ip:<地址>"
+    """
+    api_key = request.headers.get(API_KEY_HEADER)
+    if api_key:
+        key_hash = hash_api_key(api_key)
+        if key_hash in _parse_api_key_hashes(settings.api_key_hashes):
+            return f"key:{key_hash}"
+
+    if settings.trust_proxy_headers and settings.trusted_proxy_hops > 0:
+        forwarded_for = ",".join(request.headers.getlist("X-Forwarded-For"))
+        hops = [item.strip() for item in forwarded_for.split(",") if item.strip()]
+        if len(hops) >= settings.trusted_proxy_hops:
+            return f"ip:{hops[-settings.trusted_proxy_hops]}"
+
+    if request.client is not None:
+        return f"ip:{request.client.host}"
+    return "ip:unknown"
@@ -9,6 +9,46 @@ class Settings(BaseSettings):
     openai_base_url: str = "https://api.poe.com/v1"
     model_name: str = "GPT-5"
     
+    # 启动预热配置
+    warmup_llm: bool = True  # 启动时是否预热大模型连接池
+    warmup_timeout: float = 5.0  # 预热超时时间(秒)
+    
+    # Token 预算配置 (0 表示不限制)
+    tokenizer_encoding: str = "o200k_base"  # 本地 tokenizer 编码
+    tiktoken_cache_dir: str = "tiktoken"  # tokenizer 编码文件目录(相对路径基于项目根目录),加载前写入进程环境变量 TIKTOKEN_CACHE_DIR
+    prompt_compaction: bool = True  # 是否对提示词中的 JSON 数据做无损压缩
+    token_budget_chat: int = 16000  # /chat 提示词 token 上限
+    token_budget_check_missing_fields: int = 4000  # /check-missing-fields 提示词 token 上限
+    
+    # 结构化输出配置
+    structured_output: str = "json_schema"  # 缺失字段检查的输出模式: json_schema、json_object 或 off(仅提示词约束)
+    
+    # 报价会话配置
+    quote_session_timeout: float = 30.0  # /quote-session 所有部分的共同截止时间(秒)
+    
+    # 异步任务配置
+    job_backend: str = "local"  # 任务队列后端: local 或 redis
+    redis_url: str = "redis://localhost:6379/0"  # Redis 兼容服务地址
+    job_workers: int = 4  # 每个进程的 worker 数量
+    job_queue_max_size: int = 1000  # 队列中最多等待的任务数
+    job_timeout: float = 120.0  # 单个任务的超时时间(秒)
+    job_result_ttl: int = 3600  # 任务结果保留时间(秒)
+    job_callback_timeout: float = 10.0  # 回调请求超时时间(秒)
+    job_callback_secret: str = ""  # 回调签名密钥 (HMAC-SHA256),未配置时不接受 callbackUrl
+    job_callback_allowed_hosts: str = ""  # 允许回调的主机(逗号分隔,含子域名),为空时允许任意公网地址
+    
+    # 限流配置 (按 API Key 或 IP 的令牌桶)
+    rate_limit_enabled: bool = True  # 是否启用限流
+    rate_limit_backend: str = "local"  # 限流状态存储: local 或 redis (共用 redis_url)
+    rate_limit_llm_per_minute: float = 10  # 大模型接口每分钟允许的请求数
+    rate_limit_llm_burst: int = 5  # 大模型接口允许的突发请求数
+    rate_limit_catalog_per_minute: float = 120  # 产品目录接口每分钟允许的请求数
+    rate_limit_catalog_burst: int = 30  # 产品目录接口允许的突发请求数
+    rate_limit_compaction_interval: float = 60.0  # 清理空闲令牌桶的间隔(秒)
+    trust_proxy_headers: bool = False  # 是否信任 X-Forwarded-For 识别客户端 IP
+    trusted_proxy_hops: int = 1  # 服务前面会追加 X-Forwarded-For 的反向代理层数
+    api_key_hashes: str = ""  # 允许的 X-API-Key 的 SHA-256 摘要(逗号分隔),其他 Key 按 IP 限流
+    
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
@@ -0,0 +1,164 @@
+from array import array
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+import json
+
+
+# 符合标准贷款额度数据文件路径
+CONFORMING_LIMITS_FILE = Path(__file__).parent.parent / "data" / "conforming_limits.json"
+
+# 5 位邮编的取值范围 (00000 - 99999)
+ZIP_CODE_COUNT = 100000
+
+# 政府贷款项目: 超过基准额度后使用本项目的 JUMBO 产品(即政府 high-balance 产品),
+# 没有 HIGH_BALANCE 分类,也没有超出地区额度的产品
+GOVERNMENT_PROGRAMS = frozenset({"FHA", "VA"})
+
+
+class ConformingLimitTable:
+    """
+    符合标准贷款额度查询表
+
+    启动时将按邮编前缀/具体邮编配置的额度展开为一个长度 100000 的
+    字节数组,数组元素是额度值表中的下标,因此按邮编查询额度是 O(1)。
+    """
+
+    def __init__(
+        self,
+        year: int,
+        baseline_limit: int,
+        limits: List[int],
+        zip_index: array,
+        max_ltv: Dict[str, Dict[str, float]]
+    ):
+        self.year = year
+        self.baseline_limit = baseline_limit
+        self._limits = limits
+        self._zip_index = zip_index
+        self._max_ltv = max_ltv
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ConformingLimitTable":
+        """
+        从数据文件内容构建查询表
+
+        Args:
+            data: conforming_limits.json 的内容
+
+        Returns:
+            查询表实例
+        """
+        baseline = int(data["baseline_limit"])
+
+        # 下标 0 固定为基准额度,未配置的邮编都指向它
+        limits = [baseline]
+        limit_slots: Dict[int, int] = {baseline: 0}
+
+        def slot_for(limit: int) -> int:
+            if limit not in limit_slots:
+                limit_slots[limit] = len(limits)
+                limits.append(limit)
+            return limit_slots[limit]
+
+        zip_index = array("B", bytes(ZIP_CODE_COUNT))
+
+        for area in data.get("areas", []):
+            slot = slot_for(int(area["limit"]))
+            for prefix in area["zip3"]:
+                start = int(prefix) * 100
+                zip_index[start:start + 100] = array("B", [slot]) * 100
+
+        # 具体邮编覆盖前缀配置
+        for zip_code, limit in data.get("zip_overrides", {}).items():
+            zip_index[int(zip_code)] = slot_for(int(limit))
+
+        if len(limits) > 255:
+            raise ValueError("符合标准贷款额度种类过多,超出查询表容量")
+
+        return cls(
+            year=int(data["year"]),
+            baseline_limit=baseline,
+            limits=limits,
+            zip_index=zip_index,
+            max_ltv={
+                program: {bucket: float(ltv) for bucket, ltv in buckets.items()}
+                for program, buckets in data.get("max_ltv", {}).items()
+            }
+        )
+
+    def limit_for_zip(self, zip_code: Optional[int]) -> int:
+        """
+        查询邮编所在地区的符合标准贷款额度
+
+        未知或非法邮编按基准额度处理。
+        """
+        if zip_code is None or not 0 <= zip_code < ZIP_CODE_COUNT:
+            return self.baseline_limit
+        return self._limits[self._zip_index[zip_code]]
+
+    def balance_bucket(
+        self,
+        loan_amount: float,
+        zip_code: Optional[int],
+        program: str
+    ) -> Optional[str]:
+        """
+        根据贷款金额、邮编和贷款项目判断产品目录中对应的额度分类
+
+        - CONV 等常规项目: STANDARD (不超过基准额度), HIGH_BALANCE (不超过地区额度), 否则 JUMBO
+        - FHA/VA: STANDARD (不超过基准额度), JUMBO (不超过地区额度,即政府 high-balance 产品)
+          超出地区额度时没有可用产品。高成本地区的 FHA 额度与符合标准额度相同
+          (均为房价中位数的 115%,上限为基准额度的 150%),因此共用同一张查询表
+
+        Returns:
+            额度分类,该项目没有可用分类时返回 None
+        """
+        if loan_amount <= self.baseline_limit:
+            return "STANDARD"
+        within_area_limit = loan_amount <= self.limit_for_zip(zip_code)
+        if program in GOVERNMENT_PROGRAMS:
+            return "JUMBO" if within_area_limit else None
+        return "HIGH_BALANCE" if within_area_limit else "JUMBO"
+
+    def max_ltv(self, program: str, balance_bucket: str) -> Optional[float]:
+        """获取贷款项目在该额度分类下允许的最高 LTV(%),未配置时返回 None"""
+        return self._max_ltv.get(program, {}).get(balance_bucket)
+
+
+@lru_cache(maxsize=1)
+def get_conforming_limits() -> ConformingLimitTable:
+    """
+    加载符合标准贷款额度查询表(进程内只加载一次)
+    """
+    with open(CONFORMING_LIMITS_FILE, 'r', encoding='utf-8') as f:
+        return ConformingLimitTable.from_dict(json.load(f))
+
+
+def compute_loan_amount(
+    purchase_price: Optional[float],
+    down_payment: Optional[float]
+) -> Optional[float]:
+    """
+    根据购买价格和首付计算贷款金额
+
+    首付未填写时贷款金额未知(不能按 0 计算,否则 LTV 为 100% 会排除大部分产品)。
+
+    Returns:
+        贷款金额,缺少购买价格或首付时返回 None
+    """
+    if purchase_price is None or down_payment is None:
+        return None
+    return max(purchase_price - down_payment, 0.0)
+
+
+def compute_ltv(loan_amount: float, purchase_price: Optional[float]) -> Optional[float]:
+    """
+    计算贷款价值比 LTV(%)
+
+    Returns:
+        LTV 百分比,购买价格缺失或为 0 时返回 None
+    """
+    if not purchase_price:
+        return None
+    return loan_amount / purchase_price * 100
@@ -0,0 +1,430 @@
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import time
+import uuid
+
+import httpx
+
+from app.config import settings
+from app.schemas import JobStatus
+
+
+logger = logging.getLogger(__name__)
+
+# 任务处理函数: 接收请求体字典,返回响应字典
+JobHandler = Callable[[dict], Awaitable[dict]]
+
+
+class JobQueueFull(Exception):
+    """任务队列已满"""
+
+
+class InvalidCallbackUrl(ValueError):
+    """回调地址不被允许"""
+
+
+# 回调请求的签名头: sha256=HMAC(密钥, "<时间戳>.<请求体>")
+SIGNATURE_HEADER = "X-Signature"
+TIMESTAMP_HEADER = "X-Signature-Timestamp"
+
+
+def sign_callback(body: str, timestamp: int, secret: str) -> str:
+    """计算回调请求的签名,接收方用同一密钥重新计算并比较"""
+    message = f"{timestamp}.{body}".encode("utf-8")
+    return "sha256=" + hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def _host_allowed(host: str, allowed_hosts: List[str]) -> bool:
+    return any(host == allowed or host.endswith("." + allowed) for allowed in allowed_hosts)
+
+
+async def validate_callback_url(url: str) -> str:
+    """
+    检查回调地址,防止服务端请求伪造 (SSRF)
+
+    - 未配置签名密钥时不接受回调
+    - 只允许 http/https
+    - 配置了 JOB_CALLBACK_ALLOWED_HOSTS 时主机必须在列表中(含子域名)
+    - 主机解析出的任一地址为回环、内网、链路本地(含云厂商元数据地址)、保留或组播地址时拒绝
+
+    提交任务时和发送回调前各检查一次。发送回调时直接连接本次校验通过的地址
+    (见 pin_callback_url),不再重新解析域名,避免 DNS 重绑定绕过检查。
+
+    Returns:
+        校验通过的 IP 地址
+
+    Raises:
+        InvalidCallbackUrl: 回调地址不被允许
+    """
+    if not settings.job_callback_secret:
+        raise InvalidCallbackUrl("服务未配置回调签名密钥,不支持 callbackUrl")
+
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower().rstrip(".")
+    if parts.scheme not in ("http", "https") or not host:
+        raise InvalidCallbackUrl(f"回调地址无效: {url}")
+
+    allowed_hosts = [
+        item.strip().lower() for item in settings.job_callback_allowed_hosts.split(",") if item.strip()
+    ]
+    if allowed_hosts and not _host_allowed(host, allowed_hosts):
+        raise InvalidCallbackUrl(f"回调主机不在允许列表中: {host}")
+
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port)
+    except (OSError, ValueError) as e:
+        raise InvalidCallbackUrl(f"无法解析回调主机: {host}") from e
+
+    addresses = [ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos]
+    if not addresses:
+        raise InvalidCallbackUrl(f"无法解析回调主机: {host}")
+    for address in addresses:
+        if not address.is_global or address.is_multicast:
+            raise InvalidCallbackUrl(f"不允许回调内网或保留地址: {host}")
+    return str(addresses[0])
+
+
+def pin_callback_url(url: str, address: str) -> Tuple[str, Dict[str, str], Dict[str, str]]:
+    """
+    将回调地址中的主机替换为已校验的 IP 地址
+
+    原主机名通过 Host 请求头和 TLS SNI (证书也按该主机名校验) 传递,接收方看到的请求不变。
+
+    Returns:
+        (连接用的 URL, 额外请求头, httpx 请求扩展)
+    """
+    parts = urlsplit(url)
+    port = f":{parts.port}" if parts.port else ""
+    ip_host = f"[{address}]" if ":" in address else address
+    pinned_url = urlunsplit(parts._replace(netloc=ip_host + port))
+    return pinned_url, {"Host": parts.hostname + port}, {"sni_hostname": parts.hostname}
+
+
+class LocalJobBackend:
+    """
+    进程内任务队列和结果存储
+
+    - 每个客户端一个队列,出队时在客户端之间轮询,避免单个客户端占满 worker
+    - 结果按最后更新时间排序存放,过期结果从头部清理(TTL 固定,清理是均摊 O(1) 的)
+    """
+
+    def __init__(self, max_size: int, result_ttl: int):
+        self.max_size = max_size
+        self.result_ttl = result_ttl
+        self._queues: "OrderedDict[str, Deque[dict]]" = OrderedDict()
+        self._size = 0
+        self._available: Optional[asyncio.Semaphore] = None
+        self._records: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # 在事件循环中延迟创建
+        if self._available is None:
+            self._available = asyncio.Semaphore(0)
+        return self._available
+
+    async def enqueue(self, client_id: str, entry: dict):
+        if self._size >= self.max_size:
+            raise JobQueueFull(f"任务队列已满 ({self.max_size})")
+        self._queues.setdefault(client_id, deque()).append(entry)
+        self._size += 1
+        self._semaphore().release()
+
+    async def dequeue(self) -> dict:
+        await self._semaphore().acquire()
+        # 取出排在最前的客户端的第一个任务,客户端仍有任务时移到末尾
+        client_id, queue = next(iter(self._queues.items()))
+        entry = queue.popleft()
+        if queue:
+            self._queues.move_to_end(client_id)
+        else:
+            del self._queues[client_id]
+        self._size -= 1
+        return entry
+
+    async def save(self, status: JobStatus):
+        now = time.time()
+        self._records[status.jobId] = (now + self.result_ttl, status.model_dump_json())
+        self._records.move_to_end(status.jobId)
+        self._purge(now)
+
+    async def get(self, job_id: str) -> Optional[JobStatus]:
+        self._purge(time.time())
+        record = self._records.get(job_id)
+        if record is None:
+            return None
+        return JobStatus.model_validate_json(record[1])
+
+    def _purge(self, now: float):
+        while self._records:
+            job_id, (expires_at, _) = next(iter(self._records.items()))
+            if expires_at > now:
+                break
+            del self._records[job_id]
+
+    async def close(self):
+        pass
+
+
+class RedisJobBackend:
+    """
+    基于 Redis 兼容服务的任务队列和结果存储,用于多 worker 进程部署
+
+    - jobs:queue:<client> 为每个客户端的任务列表
+    - jobs:clients 为有待处理任务的客户端轮询列表
+    - jobs:size 为所有客户端等待中的任务总数,与进程内队列一样按总数限制队列长度
+    - jobs:result:<id> 保存任务状态,带过期时间
+    """
+
+    CLIENTS_KEY = "jobs:clients"
+    QUEUE_KEY = "jobs:queue:{}"
+    SIZE_KEY = "jobs:size"
+    RESULT_KEY = "jobs:result:{}"
+
+    # 原子地检查总数并入队: 返回 0 表示队列已满
+    ENQUEUE_SCRIPT = """
+local size = tonumber(redis.call('GET', KEYS[1]) or '0')
+if size >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('INCR', KEYS[1])
+if redis.call('RPUSH', KEYS[2], ARGV[2]) == 1 then
+    redis.call('RPUSH', KEYS[3], ARGV[3])
+end
+return 1
+"""
+
+    # 原子地取出客户端的第一个任务,客户端仍有任务时重新排到轮询列表末尾
+    DEQUEUE_SCRIPT = """
+local raw = redis.call('LPOP', KEYS[2])
+if redis.call('LLEN', KEYS[2]) > 0 then
+    redis.call('RPUSH', KEYS[3], ARGV[1])
+end
+if raw then
+    redis.call('DECR', KEYS[1])
+end
+return raw
+"""
+
+    def __init__(self, url: str, max_size: int, result_ttl: int):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("使用 redis 任务队列需要安装 redis 包: uv add redis") from e
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._enqueue = self._redis.register_script(self.ENQUEUE_SCRIPT)
+        self._dequeue = self._redis.register_script(self.DEQUEUE_SCRIPT)
+        self.max_size = max_size
+        self.result_ttl = result_ttl
+
+    async def enqueue(self, client_id: str, entry: dict):
+        accepted = await self._enqueue(
+            keys=[self.SIZE_KEY, self.QUEUE_KEY.format(client_id), self.CLIENTS_KEY],
+            args=[self.max_size, json.dumps(entry), client_id]
+        )
+        if not accepted:
+            raise JobQueueFull(f"任务队列已满 ({self.max_size})")
+
+    async def dequeue(self) -> dict:
+        while True:
+            item = await self._redis.blpop([self.CLIENTS_KEY], timeout=5)
+            if item is None:
+                continue
+            client_id = item[1]
+            raw = await self._dequeue(
+                keys=[self.SIZE_KEY, self.QUEUE_KEY.format(client_id), self.CLIENTS_KEY],
+                args=[client_id]
+            )
+            if raw is not None:
+                return json.loads(raw)
+
+    async def save(self, status: JobStatus):
+        await self._redis.set(
+            self.RESULT_KEY.format(status.jobId),
+            status.model_dump_json(),
+            ex=self.result_ttl
+        )
+
+    async def get(self, job_id: str) -> Optional[JobStatus]:
+        raw = await self._redis.get(self.RESULT_KEY.format(job_id))
+        if raw is None:
+            return None
+        return JobStatus.model_validate_json(raw)
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_job_backend():
+    """根据配置创建任务队列后端"""
+    if settings.job_backend == "redis":
+        return RedisJobBackend(
+            settings.redis_url,
+            settings.job_queue_max_size,
+            settings.job_result_ttl
+        )
+    return LocalJobBackend(settings.job_queue_max_size, settings.job_result_ttl)
+
+
+class JobQueue:
+    """
+    异步任务队列
+
+    提交任务后立即返回任务 ID,由固定数量的 worker 协程执行,
+    执行结果保存到后端供 /jobs/{id} 查询,并可回调客户端提供的 URL。
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, JobHandler] = {}
+        self._backend = None
+        self._workers: List[asyncio.Task] = []
+        self._http: Optional[httpx.AsyncClient] = None
+
+    def register(self, kind: str, handler: JobHandler):
+        """注册任务类型的处理函数"""
+        self._handlers[kind] = handler
+
+    def start(self, backend=None, workers: Optional[int] = None):
+        """启动 worker 协程(需在事件循环中调用)"""
+        if self._workers:
+            return
+        self._backend = backend or create_job_backend()
+        # 回调按 IP 连接,不复用连接,避免不同主机名共用同一 IP 时复用其他主机的 TLS 连接
+        self._http = httpx.AsyncClient(
+            timeout=settings.job_callback_timeout,
+            limits=httpx.Limits(max_keepalive_connections=0)
+        )
+        self._workers = [
+            asyncio.ensure_future(self._worker())
+            for _ in range(workers or settings.job_workers)
+        ]
+
+    async def stop(self):
+        """停止 worker 并释放连接"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._backend is not None:
+            await self._backend.close()
+            self._backend = None
+
+    async def submit(
+        self,
+        kind: str,
+        payload: dict,
+        client_id: str,
+        callback_url: Optional[str] = None
+    ) -> JobStatus:
+        """
+        提交任务
+
+        Raises:
+            JobQueueFull: 队列已满
+            InvalidCallbackUrl: 回调地址不被允许
+        """
+        if callback_url is not None:
+            await validate_callback_url(callback_url)
+
+        # 未经过启动阶段时(例如测试中直接使用应用)按默认配置启动
+        self.start()
+
+        now = time.time()
+        status = JobStatus(
+            jobId=uuid.uuid4().hex,
+            kind=kind,
+            status="queued",
+            createdAt=now,
+            updatedAt=now
+        )
+        await self._backend.save(status)
+        await self._backend.enqueue(client_id, {
+            "job_id": status.jobId,
+            "kind": kind,
+            "payload": payload,
+            "callback_url": callback_url,
+            "created_at": now,
+        })
+        return status
+
+    async def get(self, job_id: str) -> Optional[JobStatus]:
+        """查询任务状态,不存在或已过期时返回 None"""
+        self.start()
+        return await self._backend.get(job_id)
+
+    async def _worker(self):
+        while True:
+            try:
+                entry = await self._backend.dequeue()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("读取任务队列失败: %r", e)
+                await asyncio.sleep(1)
+                continue
+            await self._run(entry)
+
+    async def _run(self, entry: dict):
+        status = JobStatus(
+            jobId=entry["job_id"],
+            kind=entry["kind"],
+            status="running",
+            createdAt=entry["created_at"],
+            updatedAt=time.time()
+        )
+        await self._backend.save(status)
+
+        try:
+            handler = self._handlers[entry["kind"]]
+            status.result = await asyncio.wait_for(
+                handler(entry["payload"]),
+                timeout=settings.job_timeout
+            )
+            status.status = "succeeded"
+        except asyncio.TimeoutError:
+            status.status = "failed"
+            status.error = f"任务未能在 {settings.job_timeout} 秒内完成"
+        except Exception as e:
+            status.status = "failed"
+            status.error = str(e)
+
+        status.updatedAt = time.time()
+        await self._backend.save(status)
+
+        if entry.get("callback_url"):
+            await self._callback(entry["callback_url"], status)
+
+    async def _callback(self, url: str, status: JobStatus):
+        try:
+            address = await validate_callback_url(url)
+            pinned_url, host_headers, extensions = pin_callback_url(url, address)
+            body = status.model_dump_json()
+            timestamp = int(time.time())
+            # 直接连接已校验的地址;不跟随重定向(httpx 默认),避免被重定向到内网地址
+            response = await self._http.post(
+                pinned_url,
+                content=body,
+                headers={
+                    **host_headers,
+                    "Content-Type": "application/json",
+                    TIMESTAMP_HEADER: str(timestamp),
+                    SIGNATURE_HEADER: sign_callback(body, timestamp, settings.job_callback_secret),
+                },
+                extensions=extensions
+            )
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning("任务 %s 回调 %s 失败: %r", status.jobId, url, e)
+
+
+job_queue = JobQueue()
@@ -1,15 +1,43 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from langchain_openai import ChatOpenAI
+from langchain_core.messages import SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from langchain_core.utils.json import parse_json_markdown
+from pydantic import BaseModel, Field, HttpUrl, ValidationError
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
 import json
-import os
-from pathlib import Path
+import logging
+import openai
+import time
 
 from app.config import settings
+from app.catalog import (
+    DEFAULT_COST_HORIZON_YEARS,
+    LoanCatalog,
+    get_catalog,
+    preload_catalog,
+    rank_best_products
+)
+from app.clients import get_client_id
+from app.conforming_limits import compute_loan_amount, compute_ltv, get_conforming_limits
+from app.jobs import InvalidCallbackUrl, JobQueueFull, job_queue
+from app.rate_limit import RateLimitMiddleware, close_rate_limiter, rate_limit_stats
+from app.structured_output import JsonArrayItemStream, structured_output_stats, to_strict_json_schema
+from app.validation import find_missing_fields
+from app.tokens import (
+    TokenAccountingHandler,
+    TokenBudgetExceeded,
+    get_tokenizer,
+    token_usage,
+    tokenizer_status
+)
 from app.schemas import (
     ChatRequest, 
     ChatResponse, 
@@ -18,15 +46,64 @@ from app.schemas import (
     MissingFieldItem,
     LoanProduct,
     LoanProductFilterRequest,
-    GetLoanProductsResponse
+    loan_product_filter_adapter,
+    GetLoanProductsResponse,
+    JobStatus,
+    GetBestLoanProductsResponse,
+    MortgageCriteria,
+    MortgageFormData,
+    QuoteSessionResponse
 )
 
+logger = logging.getLogger(__name__)
+
+# 启动预热是否完成,/health?ready=true 据此返回就绪状态
+warmup_state = {"ready": False}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期管理
+
+    启动阶段依次:
+    1. 在线程池中预加载产品目录、额度表和 tokenizer,并构建索引
+    2. 预先渲染 /chat 提示词(嵌入产品数据)
+    3. 预热大模型客户端连接池
+    4. 启动异步任务 worker
+    完成后才标记为就绪,确保流量不会打到冷实例上。
+    """
+    warmup_state["ready"] = False
+    catalog = await preload_catalog()
+    try:
+        # 编码文件需要下载时不无限期阻塞启动,超时后在后台继续加载
+        await asyncio.wait_for(
+            asyncio.shield(run_in_threadpool(get_tokenizer)),
+            timeout=settings.warmup_timeout
+        )
+    except asyncio.TimeoutError:
+        logger.warning("tokenizer 未能在 %s 秒内加载,暂时按估算计数", settings.warmup_timeout)
+    build_chat_chain(catalog)
+    if settings.warmup_llm:
+        await warm_up_llm()
+    job_queue.start()
+    warmup_state["ready"] = True
+    yield
+    warmup_state["ready"] = False
+    await job_queue.stop()
+    await close_rate_limiter()
+
+
 app = FastAPI(
     title="Mortgage Agent API",
     description="A mortgage agent service built with FastAPI and LangChain",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
+# 按客户端限流 (先于 CORS 注册,使 429 响应同样带有 CORS 头)
+app.add_middleware(RateLimitMiddleware)
+
 # 配置 CORS 中间件 - 开发阶段允许所有域名请求
 app.add_middleware(
     CORSMiddleware,
@@ -59,9 +136,31 @@ class MissingFieldsOutput(BaseModel):
     missing_fields: List[MissingFieldOutput] = Field(description="缺失的字段列表")
 
 
-# 创建 JSON 输出解析器
+# 创建 JSON 输出解析器(仅用于生成格式说明)
 parser = JsonOutputParser(pydantic_object=MissingFieldsOutput)
 
+
+def missing_fields_response_format(mode: str) -> Optional[dict]:
+    """
+    缺失字段检查使用的服务商原生结构化输出参数
+
+    - json_schema: 按 MissingFieldsOutput 的 JSON Schema 严格约束输出 (strict),提示词中不再需要格式说明
+    - json_object: 只保证输出合法 JSON,仍需在提示词中给出格式说明
+    - off: 不使用原生结构化输出(兼容不支持 response_format 的服务商)
+    """
+    if mode == "json_schema":
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "MissingFieldsOutput",
+                "strict": True,
+                "schema": to_strict_json_schema(MissingFieldsOutput.model_json_schema()),
+            },
+        }
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
 # 创建系统提示词
 system_prompt = """You are a professional mortgage loan assistant for a mortgage recommendation website. Your role is to help users find the best mortgage rates by collecting necessary information.
 
@@ -94,27 +193,132 @@ Your messages should:
 - NEVER use sequential words like "To get started", "First", "Next", "Finally", "Firstly", "Secondly", "Lastly", etc.
 - Each message should be standalone and independent, as they will be displayed one at a time in a carousel-like rotation
 
-{format_instructions}
+If all required fields are present and valid, return an empty array for missing_fields.
+
+{format_instructions}"""
+
+def build_validation_chain(mode: str):
+    """
+    按结构化输出模式创建缺失字段检查 chain (输出 AIMessage,由 parse_missing_fields 解析)
+    
+    提示词布局: 固定指令(含格式说明)在前且每次请求完全相同,便于命中服务商的前缀缓存;
+    每次请求不同的表单数据放在最后。json_schema 模式下输出结构由服务商保证,省去格式说明。
+    """
+    format_instructions = "" if mode == "json_schema" else parser.get_format_instructions()
+    prompt = ChatPromptTemplate.from_messages([
+        SystemMessage(content=system_prompt.format(format_instructions=format_instructions).rstrip()),
+        ("human", "Please analyze the following mortgage form data and identify any missing required fields:\n\n{form_data}\n\nReturn the missing fields in JSON format.")
+    ])
+    response_format = missing_fields_response_format(mode)
+    if response_format is None:
+        return prompt | llm
+    return prompt | llm.bind(response_format=response_format)
 
-If all required fields are present and valid, return an empty array for missing_fields."""
 
-# 创建提示词模板
-prompt_template = ChatPromptTemplate.from_messages([
-    ("system", system_prompt),
-    ("human", "Please analyze the following mortgage form data and identify any missing required fields:\n\n{form_data}\n\nReturn the missing fields in JSON format.")
-])
+# 服务商拒绝 response_format 时依次降级的模式
+STRUCTURED_OUTPUT_FALLBACKS = {"json_schema": "json_object", "json_object": "off"}
 
-# 创建 LangChain chain
-validation_chain = prompt_template | llm | parser
+# 各模式的 chain,以及当前使用的模式(服务商拒绝后在进程内记住降级结果)
+validation_chains = {
+    mode: build_validation_chain(mode)
+    for mode in ("json_schema", "json_object", "off")
+}
+structured_output_state = {
+    "mode": settings.structured_output if settings.structured_output in validation_chains else "off"
+}
+
+
+def downgrade_structured_output(mode: str, error: Exception) -> bool:
+    """
+    服务商以 400 拒绝 response_format 时降级结构化输出模式
+    
+    Returns:
+        是否已降级(调用方应使用新模式重试)
+    """
+    next_mode = STRUCTURED_OUTPUT_FALLBACKS.get(mode)
+    if next_mode is None or not isinstance(error, openai.BadRequestError):
+        return False
+    message = str(error).lower()
+    if not any(word in message for word in ("response_format", "json_schema", "json_object", "structured")):
+        return False
+    if structured_output_state["mode"] == mode:
+        structured_output_state["mode"] = next_mode
+        logger.warning("服务商不支持结构化输出模式 %s,改用 %s: %r", mode, next_mode, error)
+    return True
+
+
+def parse_missing_fields(text: str) -> MissingFieldsOutput:
+    """
+    解析缺失字段检查的大模型输出(兼容 ```json 代码块)
+
+    使用严格的 json.loads,被截断的输出计为解析失败而不是静默补全。
+
+    Raises:
+        ValueError: 输出不是合法 JSON 或不符合 MissingFieldsOutput 结构
+    """
+    return MissingFieldsOutput.model_validate(parse_json_markdown(text, parser=json.loads))
+
+
+def to_missing_field_item(field: MissingFieldOutput) -> MissingFieldItem:
+    """将大模型输出的字段转换为响应模型"""
+    return MissingFieldItem(
+        key=field.key,
+        message=field.message,
+        type=field.type,
+        options=field.options
+    )
+
+
+async def warm_up_llm():
+    """
+    预热大模型客户端连接池
+
+    请求模型列表接口建立 HTTP 连接(不消耗 token),失败时只记录日志,不阻塞启动。
+    """
+    try:
+        await asyncio.wait_for(
+            llm.root_async_client.models.list(),
+            timeout=settings.warmup_timeout
+        )
+    except Exception as e:
+        logger.warning("大模型连接预热失败: %r", e)
 
 
 @app.get("/health")
-async def health_check():
-    """健康检查端点"""
+async def health_check(ready: bool = False):
+    """
+    健康检查端点
+    
+    - **ready**: 为 true 时返回就绪状态,启动预热完成前返回 503
+    """
+    if ready and not warmup_state["ready"]:
+        return JSONResponse(status_code=503, content={"status": "starting"})
     return {"status": "ok"}
 
 
-def filter_loan_products(products: List[LoanProduct], filters: LoanProductFilterRequest) -> List[LoanProduct]:
+@app.get("/metrics")
+async def metrics():
+    """
+    运行指标
+    
+    - **tokens**: 按路由汇总的大模型 token 使用量
+      (calls, prompt_tokens, completion_tokens, max_prompt_tokens, rejected)
+    - **tokenizer**: 本地 tokenizer 状态,exact 为 false 时 token 数为估算值(编码文件未能加载)
+    - **rateLimits**: 按限流策略统计的放行/拒绝次数 (当前进程)
+    - **structuredOutput**: 按路由统计的结构化输出解析失败率和第一条缺失字段提示的延迟
+      (calls, parse_failures, parse_failure_rate, first_item_latency_ms_avg, first_item_latency_ms_max)
+    - **structuredOutputMode**: 当前使用的结构化输出模式(服务商拒绝 response_format 时自动降级)
+    """
+    return {
+        "tokens": token_usage.snapshot(),
+        "tokenizer": tokenizer_status(),
+        "rateLimits": {name: dict(stats) for name, stats in rate_limit_stats.items()},
+        "structuredOutput": structured_output_stats.snapshot(),
+        "structuredOutputMode": structured_output_state["mode"]
+    }
+
+
+def filter_loan_products(products: List[LoanProduct], filters: MortgageCriteria) -> List[LoanProduct]:
     """
     根据筛选条件过滤贷款产品
     
@@ -171,9 +375,37 @@ def filter_loan_products(products: List[LoanProduct], filters: LoanProductFilter
         if p.program in allowed_programs
     ]
     
+    # 5. 根据贷款金额和邮编筛选 balance_bucket 和 LTV
+    # 贷款金额 = purchasePrice - downPayment,与所在地区的符合标准额度比较,
+    # 不同贷款项目的额度分类不同(FHA/VA 超过基准额度后使用本项目的 JUMBO 产品)
+    loan_amount = compute_loan_amount(filters.purchasePrice, filters.downPayment)
+    if loan_amount is not None:
+        limits = get_conforming_limits()
+        ltv = compute_ltv(loan_amount, filters.purchasePrice)
+        buckets: Dict[str, Optional[str]] = {}
+        for program in {p.program for p in filtered_products}:
+            buckets[program] = limits.balance_bucket(loan_amount, filters.zipCode, program)
+        
+        filtered_products = [
+            p for p in filtered_products
+            if p.balance_bucket == buckets[p.program] and is_ltv_eligible(p, ltv)
+        ]
+    
     return filtered_products
 
 
+def is_ltv_eligible(product: LoanProduct, ltv: Optional[float]) -> bool:
+    """
+    判断 LTV 是否在产品所属贷款项目和额度分类的上限之内
+    
+    LTV 未知或未配置上限时视为符合条件
+    """
+    if ltv is None:
+        return True
+    max_ltv = get_conforming_limits().max_ltv(product.program, product.balance_bucket)
+    return max_ltv is None or ltv <= max_ltv
+
+
 def match_loan_term(product_term: str, target_term: str) -> bool:
     """
     匹配贷款期限
@@ -212,8 +444,43 @@ def match_loan_term(product_term: str, target_term: str) -> bool:
         return False
 
 
-@app.post("/loan-products", response_model=GetLoanProductsResponse)
-async def get_loan_products(filters: Optional[LoanProductFilterRequest] = None):
+# 手动解析请求体时,在 OpenAPI 文档中声明请求体结构
+LOAN_PRODUCT_FILTER_OPENAPI = {
+    "requestBody": {
+        "required": False,
+        "content": {
+            "application/json": {"schema": LoanProductFilterRequest.model_json_schema()}
+        }
+    }
+}
+
+
+async def parse_loan_product_filters(request: Request) -> Optional[LoanProductFilterRequest]:
+    """
+    解析贷款产品筛选条件
+    
+    请求体为空时返回 None;校验失败时返回与 FastAPI 默认行为一致的 422 错误。
+    """
+    body = await request.body()
+    if not body:
+        return None
+    try:
+        return loan_product_filter_adapter.validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError([
+            {**error, "loc": ("body", *error["loc"])}
+            for error in e.errors(include_url=False)
+        ])
+
+
+@app.post(
+    "/loan-products",
+    response_model=GetLoanProductsResponse,
+    openapi_extra=LOAN_PRODUCT_FILTER_OPENAPI
+)
+async def get_loan_products(
+    filters: Optional[LoanProductFilterRequest] = Depends(parse_loan_product_filters)
+):
     """
     获取贷款产品列表(支持筛选)
     
@@ -225,6 +492,8 @@ async def get_loan_products(filters: Optional[LoanProductFilterRequest] = None):
     - **armOrFixed**: 利率类型 ("fix" 或 "arm")
     - **showVaLoans**: 是否显示 VA 贷款产品
     - **showFhaLoans**: 是否显示 FHA 贷款产品
+    - **purchasePrice / downPayment / zipCode**: 根据贷款金额与所在地区的符合标准额度
+      筛选 balance_bucket (STANDARD / HIGH_BALANCE / JUMBO),并按 LTV 上限排除产品
     
     注意: 默认总是包含 CONV 和 USDA 产品
     
@@ -233,33 +502,17 @@ async def get_loan_products(filters: Optional[LoanProductFilterRequest] = None):
     - **products**: 贷款产品列表
     """
     try:
-        # 获取数据文件路径
-        current_dir = Path(__file__).parent.parent
-        data_file = current_dir / "data" / "loan_products.json"
-        
-        # 检查文件是否存在
-        if not data_file.exists():
-            raise HTTPException(
-                status_code=500,
-                detail=f"贷款产品数据不存在: {data_file}"
-            )
-        
-        # 读取 JSON 数据
-        with open(data_file, 'r', encoding='utf-8') as f:
-            products_data = json.load(f)
-        
-        # 转换为 Pydantic 模型
-        all_products = [LoanProduct(**product) for product in products_data]
+        catalog = await get_catalog()
         
         # 如果没有提供筛选条件,返回所有产品
         if filters is None:
             return GetLoanProductsResponse(
-                total=len(all_products),
-                products=all_products
+                total=len(catalog.products),
+                products=catalog.products
             )
         
-        # 应用筛选条件
-        filtered_products = filter_loan_products(all_products, filters)
+        # 先通过 balance_bucket 索引缩小范围,再应用筛选条件
+        filtered_products = filter_loan_products(catalog.candidates(filters), filters)
         
         return GetLoanProductsResponse(
             total=len(filtered_products),
@@ -278,8 +531,220 @@ async def get_loan_products(filters: Optional[LoanProductFilterRequest] = None):
         )
 
 
-@app.post("/check-missing-fields", response_model=CheckMissingFieldsResponse)
-async def check_missing_fields(request: CheckMissingFieldsRequest):
+@app.post(
+    "/loan-products/best",
+    response_model=GetBestLoanProductsResponse,
+    openapi_extra=LOAN_PRODUCT_FILTER_OPENAPI
+)
+async def get_best_loan_products(
+    filters: Optional[LoanProductFilterRequest] = Depends(parse_loan_product_filters),
+    top_k: int = Query(3, alias="topK", ge=1, le=50, description="每个锁定期返回的产品数量"),
+    horizon_years: int = Query(
+        DEFAULT_COST_HORIZON_YEARS,
+        alias="horizonYears",
+        ge=1,
+        le=30,
+        description="计算有效成本的持有年限"
+    )
+):
+    """
+    获取各锁定期有效成本最低的贷款产品
+    
+    使用与 `/loan-products` 相同的筛选条件,然后对 15/30/45 天锁定期分别
+    返回有效成本最低的 top-K 产品(跨 lender 去重)。
+    
+    - **topK**: 每个锁定期返回的产品数量(默认 3)
+    - **horizonYears**: 计算有效成本的持有年限(默认 5)
+    
+    返回:
+    - **loanAmount**: 贷款金额 (purchasePrice - downPayment)
+    - **lockPeriods**: 各锁定期的最优产品,按有效成本升序
+    """
+    try:
+        catalog = await get_catalog()
+        
+        filtered_products = (
+            filter_loan_products(catalog.candidates(filters), filters)
+            if filters is not None else catalog.products
+        )
+        loan_amount = (
+            compute_loan_amount(filters.purchasePrice, filters.downPayment)
+            if filters is not None else None
+        )
+        
+        return GetBestLoanProductsResponse(
+            loanAmount=loan_amount,
+            topK=top_k,
+            lockPeriods=rank_best_products(
+                filtered_products, loan_amount, top_k, horizon_years
+            )
+        )
+        
+    except json.JSONDecodeError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"解析贷款产品数据失败: {str(e)}"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"获取最优贷款产品失败: {str(e)}"
+        )
+
+
+async def submit_job(
+    kind: str,
+    body: BaseModel,
+    http_request: Request,
+    callback_url: Optional[HttpUrl]
+) -> JSONResponse:
+    """
+    提交异步任务并立即返回 202 和任务状态
+    
+    Raises:
+        HTTPException: 回调地址不被允许时返回 400,任务队列已满时返回 503
+    """
+    try:
+        status = await job_queue.submit(
+            kind,
+            body.model_dump(),
+            get_client_id(http_request),
+            str(callback_url) if callback_url is not None else None
+        )
+    except InvalidCallbackUrl as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    return JSONResponse(
+        status_code=202,
+        content=status.model_dump(),
+        headers={"Location": f"/jobs/{status.jobId}"}
+    )
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    """
+    查询异步任务状态
+    
+    - **status**: queued, running, succeeded 或 failed
+    - **result**: 成功时为同步接口的响应内容
+    - **error**: 失败原因
+    
+    任务结果保存 JOB_RESULT_TTL 秒,过期后返回 404。
+    """
+    status = await job_queue.get(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在或已过期: {job_id}")
+    return status
+
+
+def missing_fields_chain_input(request: CheckMissingFieldsRequest) -> dict:
+    """构造缺失字段检查 chain 的输入"""
+    # 将表单数据转换为 JSON 字符串 (null 与缺失字段等价,压缩时直接删除)
+    if settings.prompt_compaction:
+        form_data_json = request.formData.model_dump_json(exclude_none=True)
+    else:
+        form_data_json = request.formData.model_dump_json(indent=2)
+    return {"form_data": form_data_json}
+
+
+async def invoke_validation_chain(chain_input: dict, config: dict):
+    """调用缺失字段检查 chain,服务商拒绝 response_format 时降级后重试"""
+    while True:
+        mode = structured_output_state["mode"]
+        try:
+            return await validation_chains[mode].ainvoke(chain_input, config=config)
+        except openai.BadRequestError as e:
+            if not downgrade_structured_output(mode, e):
+                raise
+
+
+async def astream_validation_chain(chain_input: dict, config: dict):
+    """流式调用缺失字段检查 chain,服务商拒绝 response_format 时降级后重试(仅在收到输出前)"""
+    while True:
+        mode = structured_output_state["mode"]
+        started = False
+        try:
+            async for chunk in validation_chains[mode].astream(chain_input, config=config):
+                started = True
+                yield chunk
+            return
+        except openai.BadRequestError as e:
+            if started or not downgrade_structured_output(mode, e):
+                raise
+
+
+async def run_check_missing_fields(request: CheckMissingFieldsRequest) -> CheckMissingFieldsResponse:
+    """调用大模型检查缺失字段(同步接口和异步任务共用)"""
+    route = "check_missing_fields"
+    started_at = time.perf_counter()
+    
+    # 调用 LangChain validation chain,并统计 token 使用量
+    token_handler = TokenAccountingHandler(route, settings.token_budget_check_missing_fields)
+    message = await invoke_validation_chain(
+        missing_fields_chain_input(request),
+        config={"callbacks": [token_handler]}
+    )
+    
+    # 解析结果并转换为响应模型
+    try:
+        output = parse_missing_fields(message.content)
+    except ValueError:
+        structured_output_stats.record_call(route, parse_failed=True)
+        raise
+    structured_output_stats.record_call(route)
+    # 非流式接口的第一条提示与完整结果同时可用
+    structured_output_stats.record_first_item(route, time.perf_counter() - started_at)
+    
+    return CheckMissingFieldsResponse(
+        missingFields=[to_missing_field_item(field) for field in output.missing_fields]
+    )
+
+
+async def stream_check_missing_fields(request: CheckMissingFieldsRequest) -> AsyncIterator[MissingFieldItem]:
+    """
+    流式调用大模型检查缺失字段,每个字段的 JSON 对象一结束就立即返回
+
+    输出结束后再完整解析一次,用于统计解析失败(已返回的字段不会撤回)。
+    """
+    route = "check_missing_fields_stream"
+    started_at = time.perf_counter()
+    item_stream = JsonArrayItemStream()
+    first_item = True
+    
+    token_handler = TokenAccountingHandler(route, settings.token_budget_check_missing_fields)
+    chunks = astream_validation_chain(
+        missing_fields_chain_input(request),
+        config={"callbacks": [token_handler]}
+    )
+    try:
+        async for chunk in chunks:
+            for raw_field in item_stream.feed(chunk.content):
+                field = to_missing_field_item(MissingFieldOutput.model_validate(raw_field))
+                if first_item:
+                    structured_output_stats.record_first_item(route, time.perf_counter() - started_at)
+                    first_item = False
+                yield field
+        parse_missing_fields(item_stream.text)
+    except ValueError:
+        structured_output_stats.record_call(route, parse_failed=True)
+        raise
+    structured_output_stats.record_call(route)
+
+
+@app.post(
+    "/check-missing-fields",
+    response_model=CheckMissingFieldsResponse,
+    responses={202: {"model": JobStatus, "description": "异步模式下返回任务状态"}}
+)
+async def check_missing_fields(
+    request: CheckMissingFieldsRequest,
+    http_request: Request,
+    async_mode: bool = Query(False, alias="async", description="是否以异步任务方式执行"),
+    callback_url: Optional[HttpUrl] = Query(None, alias="callbackUrl", description="异步任务完成后回调的 URL")
+):
     """
     检查房贷表单数据中缺失的字段
     
@@ -287,37 +752,19 @@ async def check_missing_fields(request: CheckMissingFieldsRequest):
     并为每个缺失字段生成友好的提示消息，引导用户补充信息。
     
     - **formData**: 房贷表单数据对象
+    - **async**: 为 true 时立即返回 202 和任务 ID,通过 `/jobs/{id}` 查询结果
+    - **callbackUrl**: 异步任务完成后以 POST 推送任务状态的地址(可选,需配置 JOB_CALLBACK_SECRET,不允许内网地址)
     
     返回:
     - **missingFields**: 缺失字段列表，如果所有字段都完整则返回空数组
     """
+    if async_mode:
+        return await submit_job("check_missing_fields", request, http_request, callback_url)
+    
     try:
-        # 将表单数据转换为 JSON 字符串
-        form_data_dict = request.formData.dict()
-        form_data_json = json.dumps(form_data_dict, indent=2)
-        
-        # 调用 LangChain validation chain
-        result = await validation_chain.ainvoke({
-            "form_data": form_data_json,
-            "format_instructions": parser.get_format_instructions()
-        })
-        
-        # 解析结果并转换为响应模型
-        missing_fields_list = result.get("missing_fields", [])
-        
-        # 转换为 Pydantic 模型
-        missing_fields = [
-            MissingFieldItem(
-                key=field["key"],
-                message=field["message"],
-                type=field["type"],
-                options=field.get("options")
-            )
-            for field in missing_fields_list
-        ]
-        
-        return CheckMissingFieldsResponse(missingFields=missing_fields)
-        
+        return await run_check_missing_fields(request)
+    except TokenBudgetExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500, 
@@ -325,31 +772,46 @@ async def check_missing_fields(request: CheckMissingFieldsRequest):
         )
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+@app.post("/check-missing-fields/stream")
+async def check_missing_fields_stream(request: CheckMissingFieldsRequest):
     """
-    与大模型对话的接口 - 贷款产品推荐和咨询
+    检查房贷表单数据中缺失的字段(流式)
     
-    该接口专门用于:
-    - 推荐合适的贷款产品
-    - 解答贷款相关问题
-    - 解释贷款专业术语
+    返回 `application/x-ndjson`,大模型每生成完一个缺失字段就立即输出一行 MissingFieldItem,
+    前端可以在完整结果返回前开始轮播第一条提示。出错时最后一行为 `{"error": "..."}`。
     
-    - **message**: 用户输入的消息
+    - **formData**: 房贷表单数据对象
     """
+    fields = stream_check_missing_fields(request)
+    
+    # 先取出第一个字段,使提示词超出预算等请求前的错误仍以 HTTP 状态码返回
     try:
-        # 加载贷款产品数据
-        current_dir = Path(__file__).parent.parent
-        data_file = current_dir / "data" / "loan_products.json"
-        
-        # 加载贷款产品数据
-        products_data = []
-        if data_file.exists():
-            with open(data_file, 'r', encoding='utf-8') as f:
-                products_data = json.load(f)
-        
-        # 创建贷款顾问的系统提示词(不包含产品数据,避免花括号冲突)
-        loan_advisor_system_prompt = """You are a professional mortgage loan advisor assistant, specializing in helping users understand and select suitable loan products.
+        first_field = await fields.__anext__()
+    except StopAsyncIteration:
+        first_field = None
+    except TokenBudgetExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, 
+            detail=f"检查表单字段失败: {str(e)}"
+        )
+    
+    async def ndjson_lines():
+        if first_field is None:
+            return
+        yield first_field.model_dump_json() + "\n"
+        try:
+            async for field in fields:
+                yield field.model_dump_json() + "\n"
+        except Exception as e:
+            yield json.dumps({"error": f"检查表单字段失败: {str(e)}"}, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+# 创建贷款顾问的系统提示词(固定指令,不包含产品数据)
+loan_advisor_system_prompt = """You are a professional mortgage loan advisor assistant, specializing in helping users understand and select suitable loan products.
 
 Your responsibilities include:
 1. **Recommend Loan Products**: Based on user requirements (such as credit score, loan term, loan amount, etc.), recommend the most suitable options from available loan products
@@ -392,29 +854,227 @@ Your responsibilities include:
 - term: Loan term
 - lender: Lending institution
 
-When answering, please refer to the loan product data provided below:
+The loan product data may be given as a table: "columns" lists the field names above, and each entry in "rows" is one product with values in column order.
 
-{loan_products}"""
-        
-        # 创建对话提示词模板
-        chat_prompt = ChatPromptTemplate.from_messages([
-            ("system", loan_advisor_system_prompt),
-            ("human", "{message}")
-        ])
-        
-        # 创建对话链
-        chat_chain = chat_prompt | llm
-        
-        # 将产品数据格式化为字符串
-        loan_products_str = json.dumps(products_data, ensure_ascii=False, indent=2)
-        
-        # 调用大模型,传入消息和产品数据
-        response = await chat_chain.ainvoke({
-            "message": request.message,
-            "loan_products": loan_products_str
-        })
-        
-        return ChatResponse(response=response.content)
+When answering, please refer to the loan product catalog provided in the next message."""
+
+# 预先渲染好产品数据的对话链,在启动阶段构建
+_chat_chain = None
+
+
+def build_chat_chain(catalog: LoanCatalog):
+    """
+    使用产品目录预先渲染对话提示词并构建对话链
+    
+    提示词布局(便于命中服务商的前缀缓存):
+    1. 固定指令,所有请求完全相同
+    2. 带版本号的产品目录,目录更新前所有请求完全相同
+    3. 用户消息
+    """
+    global _chat_chain
+    chat_prompt = ChatPromptTemplate.from_messages([
+        SystemMessage(content=loan_advisor_system_prompt),
+        SystemMessage(content=f"Loan product catalog (version {catalog.version}):\n\n{catalog.products_json}"),
+        ("human", "{message}")
+    ])
+    _chat_chain = chat_prompt | llm
+    return _chat_chain
+
+
+async def get_chat_chain():
+    """获取对话链,未经过启动阶段时按当前产品目录构建"""
+    if _chat_chain is None:
+        return build_chat_chain(await get_catalog())
+    return _chat_chain
+
+
+async def run_chat(request: ChatRequest) -> ChatResponse:
+    """调用大模型进行对话(同步接口和异步任务共用)"""
+    chat_chain = await get_chat_chain()
+    
+    # 调用大模型,产品数据已在提示词中预先渲染
+    token_handler = TokenAccountingHandler("chat", settings.token_budget_chat)
+    response = await chat_chain.ainvoke(
+        {"message": request.message},
+        config={"callbacks": [token_handler]}
+    )
+    
+    return ChatResponse(response=response.content)
+
+
+@app.post(
+    "/chat",
+    response_model=ChatResponse,
+    responses={202: {"model": JobStatus, "description": "异步模式下返回任务状态"}}
+)
+async def chat(
+    request: ChatRequest,
+    http_request: Request,
+    async_mode: bool = Query(False, alias="async", description="是否以异步任务方式执行"),
+    callback_url: Optional[HttpUrl] = Query(None, alias="callbackUrl", description="异步任务完成后回调的 URL")
+):
+    """
+    与大模型对话的接口 - 贷款产品推荐和咨询
+    
+    该接口专门用于:
+    - 推荐合适的贷款产品
+    - 解答贷款相关问题
+    - 解释贷款专业术语
+    
+    - **message**: 用户输入的消息
+    - **async**: 为 true 时立即返回 202 和任务 ID,通过 `/jobs/{id}` 查询结果
+    - **callbackUrl**: 异步任务完成后以 POST 推送任务状态的地址(可选,需配置 JOB_CALLBACK_SECRET,不允许内网地址)
+    """
+    if async_mode:
+        return await submit_job("chat", request, http_request, callback_url)
+    
+    try:
+        return await run_chat(request)
+    except TokenBudgetExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"调用大模型失败: {str(e)}")
 
+
+async def chat_job(payload: dict) -> dict:
+    """异步任务: /chat"""
+    return (await run_chat(ChatRequest(**payload))).model_dump()
+
+
+async def check_missing_fields_job(payload: dict) -> dict:
+    """异步任务: /check-missing-fields"""
+    return (await run_check_missing_fields(CheckMissingFieldsRequest(**payload))).model_dump()
+
+
+job_queue.register("chat", chat_job)
+job_queue.register("check_missing_fields", check_missing_fields_job)
+
+
+
+async def quote_missing_fields(form_data: MortgageFormData) -> List[dict]:
+    """报价会话: 按固定规则检查缺失字段"""
+    return [field.model_dump() for field in find_missing_fields(form_data)]
+
+
+async def quote_products(form_data: MortgageFormData) -> List[dict]:
+    """报价会话: 按表单数据筛选贷款产品"""
+    catalog = await get_catalog()
+    products = filter_loan_products(catalog.candidates(form_data), form_data)
+    return [product.model_dump() for product in products]
+
+
+async def quote_advice(form_data: MortgageFormData) -> str:
+    """报价会话: 由大模型根据表单数据生成贷款建议"""
+    chat_chain = await get_chat_chain()
+    token_handler = TokenAccountingHandler("quote_session", settings.token_budget_chat)
+    message = (
+        "Based on the following mortgage form data, recommend the most suitable loan "
+        "products and briefly explain why:\n\n" + form_data.model_dump_json(exclude_none=True)
+    )
+    response = await chat_chain.ainvoke(
+        {"message": message},
+        config={"callbacks": [token_handler]}
+    )
+    return response.content
+
+
+async def run_quote_session(
+    form_data: MortgageFormData,
+    include_advice: bool,
+    timeout: float
+) -> AsyncIterator[Tuple[str, Optional[object], Optional[str]]]:
+    """
+    并发执行报价会话的各个部分,按完成顺序逐个产出结果
+    
+    所有部分共用一个截止时间,超时的部分会被取消并以错误形式产出。
+    
+    Yields:
+        (部分名称, 结果, 错误信息) - 成功时错误信息为 None,失败时结果为 None
+    """
+    parts = {
+        "missingFields": quote_missing_fields(form_data),
+        "products": quote_products(form_data),
+    }
+    if include_advice:
+        parts["advice"] = quote_advice(form_data)
+    
+    tasks = {asyncio.ensure_future(coro): name for name, coro in parts.items()}
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    pending = set(tasks)
+    
+    try:
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=remaining,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                try:
+                    yield tasks[task], task.result(), None
+                except Exception as e:
+                    yield tasks[task], None, str(e)
+        
+        for task in pending:
+            task.cancel()
+            yield tasks[task], None, f"未能在 {timeout} 秒内完成"
+    finally:
+        # 客户端断开等情况下取消仍在运行的部分
+        for task in pending:
+            task.cancel()
+
+
+@app.post("/quote-session", response_model=QuoteSessionResponse)
+async def quote_session(
+    form_data: MortgageFormData,
+    include_advice: bool = Query(True, alias="includeAdvice", description="是否生成大模型贷款建议"),
+    stream: bool = Query(False, description="是否以 NDJSON 流式返回各部分结果")
+):
+    """
+    报价会话 - 一次请求同时获取缺失字段、匹配产品和贷款建议
+    
+    缺失字段检查(固定规则)、产品筛选和大模型建议并发执行,共用一个截止时间。
+    
+    - **请求体**: 房贷表单数据对象 (与 formData 相同)
+    - **includeAdvice**: 是否生成大模型贷款建议(默认 true)
+    - **stream**: 为 true 时返回 `application/x-ndjson`,每个部分完成后立即输出一行
+      `{"part": "missingFields" | "products" | "advice", "data": ..., "error": ...}`
+    
+    返回:
+    - **missingFields**: 缺失字段列表
+    - **total** / **products**: 匹配的贷款产品
+    - **advice**: 贷款建议
+    - **errors**: 超时或失败的部分
+    """
+    session = run_quote_session(form_data, include_advice, settings.quote_session_timeout)
+    
+    if stream:
+        async def ndjson_lines():
+            async for part, data, error in session:
+                yield json.dumps(
+                    {"part": part, "data": data, "error": error},
+                    ensure_ascii=False
+                ) + "\n"
+        
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+    
+    results: Dict[str, object] = {}
+    errors: Dict[str, str] = {}
+    async for part, data, error in session:
+        if error is not None:
+            errors[part] = error
+        else:
+            results[part] = data
+    
+    products = results.get("products", [])
+    return QuoteSessionResponse(
+        missingFields=results.get("missingFields", []),
+        total=len(products),
+        products=products,
+        advice=results.get("advice"),
+        errors=errors
+    )
@@ -0,0 +1,247 @@
+from typing import Dict, List, Optional
+import logging
+import math
+import time
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter, ValidationError
+
+from app.clients import get_client_id
+from app.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitPolicy:
+    """
+    令牌桶限流策略
+
+    Args:
+        name: 策略名称,同时作为桶键的前缀
+        per_minute: 每分钟补充的令牌数
+        burst: 桶容量,即允许的瞬时突发请求数
+    """
+
+    def __init__(self, name: str, per_minute: float, burst: int):
+        self.name = name
+        self.rate = per_minute / 60
+        self.burst = burst
+
+
+class LocalRateLimiter:
+    """
+    进程内令牌桶
+
+    每个 (策略, 客户端) 一个桶,存放 [剩余令牌, 更新时间, 补满时间],单次请求 O(1)。
+    定期清理已经补满的桶(与新建的桶等价),避免长期不活跃的客户端占用内存。
+    """
+
+    def __init__(self, compaction_interval: float):
+        self.compaction_interval = compaction_interval
+        self._buckets: Dict[str, List[float]] = {}
+        self._next_compaction = time.monotonic() + compaction_interval
+
+    async def acquire(self, key: str, policy: RateLimitPolicy) -> float:
+        """
+        从桶中取出一个令牌
+
+        Returns:
+            0 表示允许请求,否则为需要等待的秒数
+        """
+        now = time.monotonic()
+        if now >= self._next_compaction:
+            self._compact(now)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = float(policy.burst)
+        else:
+            tokens = min(policy.burst, bucket[0] + (now - bucket[1]) * policy.rate)
+
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / policy.rate
+
+        self._buckets[key] = [tokens, now, now + (policy.burst - tokens) / policy.rate]
+        return retry_after
+
+    def _compact(self, now: float):
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items() if bucket[2] > now
+        }
+        self._next_compaction = now + self.compaction_interval
+
+    async def close(self):
+        pass
+
+
+# 令牌桶的原子更新脚本: 返回需要等待的秒数,0 表示允许请求
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1)
+return tostring(retry_after)
+"""
+
+
+class RedisRateLimiter:
+    """
+    基于 Redis 兼容服务的令牌桶,多个 worker 进程共享限流状态
+
+    桶在补满所需的时间后自动过期,不需要额外的清理。
+    """
+
+    KEY = "ratelimit:{}"
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("使用 redis 限流需要安装 redis 包: uv add redis") from e
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._script = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def acquire(self, key: str, policy: RateLimitPolicy) -> float:
+        result = await self._script(
+            keys=[self.KEY.format(key)],
+            args=[policy.rate, policy.burst, time.time()]
+        )
+        return float(result)
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_rate_limiter():
+    """根据配置创建限流器"""
+    if settings.rate_limit_backend == "redis":
+        return RedisRateLimiter(settings.redis_url)
+    return LocalRateLimiter(settings.rate_limit_compaction_interval)
+
+
+_rate_limiter = None
+
+
+def get_rate_limiter():
+    """获取限流器(首次使用时创建)"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = create_rate_limiter()
+    return _rate_limiter
+
+
+async def close_rate_limiter():
+    """释放限流器的连接"""
+    global _rate_limiter
+    if _rate_limiter is not None:
+        await _rate_limiter.close()
+        _rate_limiter = None
+
+
+# 按策略统计的放行/拒绝次数
+rate_limit_stats: Dict[str, Dict[str, int]] = {}
+
+
+# 调用大模型的接口
+LLM_ROUTES = {"/chat", "/check-missing-fields", "/check-missing-fields/stream", "/quote-session"}
+
+# 只读取产品目录或任务状态的接口
+CATALOG_ROUTE_PREFIXES = ("/loan-products", "/jobs/")
+
+_bool_adapter = TypeAdapter(bool)
+
+
+def parse_bool_param(value: Optional[str], default: bool) -> bool:
+    """按 FastAPI 的规则解析布尔查询参数 (true/false、1/0、yes/no、on/off 等),无效时返回默认值"""
+    if value is None:
+        return default
+    try:
+        return _bool_adapter.validate_python(value)
+    except ValidationError:
+        return default
+
+
+class RateLimitMiddleware:
+    """
+    按客户端(API Key 或 IP)限流的 ASGI 中间件
+
+    大模型接口和产品目录接口使用不同的令牌桶,超出限制时返回 429 和 Retry-After。
+    /health、/metrics、文档等其他路径不限流。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.llm_policy = RateLimitPolicy(
+            "llm",
+            settings.rate_limit_llm_per_minute,
+            settings.rate_limit_llm_burst
+        )
+        self.catalog_policy = RateLimitPolicy(
+            "catalog",
+            settings.rate_limit_catalog_per_minute,
+            settings.rate_limit_catalog_burst
+        )
+        for policy in (self.llm_policy, self.catalog_policy):
+            rate_limit_stats.setdefault(policy.name, {"allowed": 0, "limited": 0})
+
+    def policy_for(self, request: Request) -> Optional[RateLimitPolicy]:
+        """根据请求路径选择限流策略,不限流的路径返回 None"""
+        path = request.url.path
+        if path in LLM_ROUTES:
+            # 不生成大模型建议的报价会话只做筛选
+            if path == "/quote-session" and not parse_bool_param(
+                request.query_params.get("includeAdvice"), True
+            ):
+                return self.catalog_policy
+            return self.llm_policy
+        if path.startswith(CATALOG_ROUTE_PREFIXES):
+            return self.catalog_policy
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.rate_limit_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        policy = self.policy_for(request)
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+
+        key = f"{policy.name}:{get_client_id(request)}"
+        try:
+            retry_after = await get_rate_limiter().acquire(key, policy)
+        except Exception as e:
+            # 限流后端不可用时放行请求,避免影响正常服务
+            logger.warning("限流检查失败,放行请求: %r", e)
+            retry_after = 0
+
+        if retry_after > 0:
+            rate_limit_stats[policy.name]["limited"] += 1
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "请求过于频繁,请稍后再试"},
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+            await response(scope, receive, send)
+            return
+
+        rate_limit_stats[policy.name]["allowed"] += 1
+        await self.app(scope, receive, send)
@@ -1,20 +1,36 @@
-from typing import List, Optional, Union
-from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional, Union
+from typing_extensions import Annotated
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints, TypeAdapter
 
 
-class MortgageFormData(BaseModel):
-    """房贷表单数据模型"""
-    mortgageType: Optional[str] = Field(None, description="贷款类型: purchase 或 refinance")
+# 选项字段: 去除首尾空白并转换为小写 (由 pydantic-core 完成,不经过 Python 校验函数)
+OptionStr = Annotated[str, StringConstraints(strip_whitespace=True, to_lower=True)]
+
+
+class MortgageCriteria(BaseModel):
+    """
+    房贷条件基础模型
+    
+    表单数据和产品筛选条件共用同一组字段。类型校验为严格模式(不做字符串到数值、
+    布尔值的隐式转换),选项字段统一转换为小写。
+    """
+    model_config = ConfigDict(strict=True)
+    
+    mortgageType: Optional[OptionStr] = Field(None, description="贷款类型: purchase 或 refinance")
     zipCode: Optional[int] = Field(None, description="邮编")
     purchasePrice: Optional[float] = Field(None, description="购买价格")
     downPayment: Optional[float] = Field(None, description="首付金额")
-    creditScore: Optional[List[Optional[int]]] = Field(None, description="信用分数范围 [min, max]")
-    loanTerm: Optional[int] = Field(None, description="贷款期限（年）")
-    armOrFixed: Optional[str] = Field(None, description="贷款类型: fix 或 arm")
+    creditScore: Optional[List[Optional[int]]] = Field(None, max_length=2, description="信用分数范围 [min, max]")
+    loanTerm: Optional[int] = Field(None, description="贷款期限(年)")
+    armOrFixed: Optional[OptionStr] = Field(None, description="贷款类型: fix 或 arm")
     showFhaLoans: Optional[bool] = Field(None, description="是否显示 FHA 贷款")
     showVaLoans: Optional[bool] = Field(None, description="是否显示 VA 贷款")
 
 
+class MortgageFormData(MortgageCriteria):
+    """房贷表单数据模型"""
+
+
 class MissingFieldItem(BaseModel):
     """缺失字段项"""
     key: str = Field(..., description="字段名称")
@@ -61,17 +77,13 @@ class LoanProduct(BaseModel):
     lender: str = Field(..., description="贷款机构")
 
 
-class LoanProductFilterRequest(BaseModel):
+class LoanProductFilterRequest(MortgageCriteria):
     """贷款产品筛选请求模型"""
-    mortgageType: Optional[str] = Field(None, description="贷款类型: purchase 或 refinance")
-    zipCode: Optional[int] = Field(None, description="邮编")
-    purchasePrice: Optional[float] = Field(None, description="购买价格")
-    downPayment: Optional[float] = Field(None, description="首付金额")
-    creditScore: Optional[List[Optional[int]]] = Field(None, description="信用分数范围 [min, max]")
-    loanTerm: Optional[int] = Field(None, description="贷款期限(年)")
-    armOrFixed: Optional[str] = Field(None, description="贷款类型: fix 或 arm")
-    showFhaLoans: Optional[bool] = Field(None, description="是否显示 FHA 贷款")
-    showVaLoans: Optional[bool] = Field(None, description="是否显示 VA 贷款")
+
+
+# 筛选条件的快速解析路径: 直接从请求体字节校验,跳过 json.loads 生成中间字典
+# (请求体为空或 null 时返回 None)
+loan_product_filter_adapter = TypeAdapter(Optional[LoanProductFilterRequest])
 
 
 class GetLoanProductsResponse(BaseModel):
@@ -79,3 +91,44 @@ class GetLoanProductsResponse(BaseModel):
     total: int = Field(..., description="产品总数")
     products: List[LoanProduct] = Field(..., description="贷款产品列表")
 
+
+
+class RankedLoanProduct(BaseModel):
+    """按有效成本排序后的贷款产品"""
+    product: LoanProduct = Field(..., description="贷款产品")
+    price: float = Field(..., description="该锁定期的价格点数")
+    effectiveCost: Optional[float] = Field(None, description="有效成本(美元),缺少贷款金额时为 null")
+
+
+class LockPeriodRanking(BaseModel):
+    """单个锁定期的最优产品排名"""
+    lockDays: int = Field(..., description="锁定天数: 15, 30, 45")
+    products: List[RankedLoanProduct] = Field(..., description="按有效成本升序排列的产品")
+
+
+class GetBestLoanProductsResponse(BaseModel):
+    """最优贷款产品响应模型"""
+    loanAmount: Optional[float] = Field(None, description="贷款金额 (purchasePrice - downPayment)")
+    topK: int = Field(..., description="每个锁定期返回的产品数量上限")
+    lockPeriods: List[LockPeriodRanking] = Field(..., description="各锁定期的最优产品")
+
+
+class QuoteSessionResponse(BaseModel):
+    """报价会话响应模型(缺失字段、匹配产品和顾问建议合并返回)"""
+    missingFields: List[MissingFieldItem] = Field(..., description="缺失的字段列表")
+    total: int = Field(..., description="匹配的产品总数")
+    products: List[LoanProduct] = Field(..., description="匹配的贷款产品列表")
+    advice: Optional[str] = Field(None, description="大模型生成的贷款建议,未请求或未完成时为 null")
+    errors: Dict[str, str] = Field(default_factory=dict, description="未能在截止时间内完成或执行失败的部分")
+
+
+# 异步任务相关模型
+class JobStatus(BaseModel):
+    """异步任务状态模型"""
+    jobId: str = Field(..., description="任务 ID")
+    kind: str = Field(..., description="任务类型: chat, check_missing_fields")
+    status: str = Field(..., description="任务状态: queued, running, succeeded, failed")
+    result: Optional[Dict[str, Any]] = Field(None, description="任务结果,与同步接口的响应相同")
+    error: Optional[str] = Field(None, description="失败原因")
+    createdAt: float = Field(..., description="创建时间 (Unix 时间戳)")
+    updatedAt: float = Field(..., description="更新时间 (Unix 时间戳)")
@@ -0,0 +1,168 @@
+from threading import Lock
+from typing import Any, Dict, List, Optional
+import json
+
+
+class JsonArrayItemStream:
+    """
+    流式 JSON 的增量解析器
+
+    逐块输入大模型输出的 JSON 文本,每当顶层对象中第一个数组
+    (例如 {"missing_fields": [...]}) 的某个元素完整结束时立即返回该元素。
+    只扫描新输入的字符并维护括号深度和字符串状态,总开销与输出长度成线性关系。
+    JSON 之外的内容(例如 ```json 代码块标记)会被忽略。
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._array_depth: Optional[int] = None
+        self._array_closed = False
+        self._item_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Any]:
+        """
+        输入一段文本
+
+        Returns:
+            本次输入后新完成的数组元素列表
+        """
+        self.text += chunk
+        items = []
+
+        while self._pos < len(self.text):
+            i = self._pos
+            char = self.text[i]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if (
+                    char == "["
+                    and self._depth == 2
+                    and self._array_depth is None
+                    and not self._array_closed
+                ):
+                    self._array_depth = self._depth
+                elif (
+                    char == "{"
+                    and self._array_depth is not None
+                    and self._depth == self._array_depth + 1
+                ):
+                    self._item_start = i
+            elif char in "}]":
+                if (
+                    char == "}"
+                    and self._array_depth is not None
+                    and self._depth == self._array_depth + 1
+                    and self._item_start is not None
+                ):
+                    items.append(json.loads(self.text[self._item_start:i + 1]))
+                    self._item_start = None
+                elif char == "]" and self._depth == self._array_depth:
+                    self._array_depth = None
+                    self._array_closed = True
+                self._depth -= 1
+
+        return items
+
+
+def to_strict_json_schema(schema: Any) -> Any:
+    """
+    将 Pydantic 生成的 JSON Schema 转换为服务商严格模式 (strict) 可接受的形式
+
+    严格模式要求每个对象列出全部属性为 required 且 additionalProperties 为 false;
+    原本可选的字段在 Pydantic 中已是 anyOf [..., null],转换后以 null 表示未填写。
+    同时删除严格模式不支持的 default。
+    """
+    if isinstance(schema, list):
+        return [to_strict_json_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+
+    result = {
+        key: to_strict_json_schema(value)
+        for key, value in schema.items()
+        if key != "default"
+    }
+    if result.get("type") == "object" and "properties" in result:
+        result["required"] = list(result["properties"])
+        result["additionalProperties"] = False
+    return result
+
+
+class StructuredOutputStats:
+    """
+    结构化输出指标
+
+    - parse_failures / parse_failure_rate: 大模型输出无法解析为目标结构的次数和比例
+    - first_item_latency_ms: 从请求开始到第一条缺失字段提示可用的耗时
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._routes: Dict[str, Dict[str, float]] = {}
+
+    def _route(self, route: str) -> Dict[str, float]:
+        return self._routes.setdefault(route, {
+            "calls": 0,
+            "parse_failures": 0,
+            "first_item_count": 0,
+            "first_item_latency_ms_total": 0.0,
+            "first_item_latency_ms_max": 0.0,
+        })
+
+    def record_call(self, route: str, parse_failed: bool = False):
+        """记录一次调用及其是否解析失败"""
+        with self._lock:
+            stats = self._route(route)
+            stats["calls"] += 1
+            if parse_failed:
+                stats["parse_failures"] += 1
+
+    def record_first_item(self, route: str, latency_seconds: float):
+        """记录第一条结果可用的耗时"""
+        latency_ms = latency_seconds * 1000
+        with self._lock:
+            stats = self._route(route)
+            stats["first_item_count"] += 1
+            stats["first_item_latency_ms_total"] += latency_ms
+            stats["first_item_latency_ms_max"] = max(stats["first_item_latency_ms_max"], latency_ms)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """返回当前统计数据"""
+        with self._lock:
+            result = {}
+            for route, stats in self._routes.items():
+                calls = stats["calls"]
+                first_item_count = stats["first_item_count"]
+                result[route] = {
+                    "calls": calls,
+                    "parse_failures": stats["parse_failures"],
+                    "parse_failure_rate": (
+                        round(stats["parse_failures"] / calls, 4) if calls else None
+                    ),
+                    "first_item_latency_ms_avg": (
+                        round(stats["first_item_latency_ms_total"] / first_item_count, 1)
+                        if first_item_count else None
+                    ),
+                    "first_item_latency_ms_max": round(stats["first_item_latency_ms_max"], 1),
+                }
+            return result
+
+
+structured_output_stats = StructuredOutputStats()
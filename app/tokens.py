@@ -0,0 +1,252 @@
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, List, Optional
+import json
+import logging
+import os
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+
+from app.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# 项目根目录,相对路径的 tokenizer 编码文件目录基于此解析
+PROJECT_ROOT = Path(__file__).parent.parent
+
+# 每条消息的固定开销(角色、分隔符)以及回复的起始开销,参考 OpenAI 的计数方式
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+
+class TokenBudgetExceeded(Exception):
+    """提示词 token 数超出路由预算"""
+
+    def __init__(self, route: str, prompt_tokens: int, budget: int):
+        self.route = route
+        self.prompt_tokens = prompt_tokens
+        self.budget = budget
+        super().__init__(
+            f"提示词 token 数 {prompt_tokens} 超出 {route} 的预算 {budget}"
+        )
+
+
+_tokenizer_lock = Lock()
+_tokenizer = None
+_tokenizer_loaded = False
+
+
+def get_tokenizer():
+    """
+    加载本地 tokenizer(进程内只加载一次)
+
+    tiktoken 从环境变量 TIKTOKEN_CACHE_DIR 读取编码文件,该目录由 TIKTOKEN_CACHE_DIR 配置
+    写入进程环境(.env 中的配置不会自动导出到环境变量)。Docker 镜像在构建时已把编码文件下载到
+    /app/tiktoken (不在挂载的 data 目录下);目录中没有编码文件时 tiktoken 会联网下载,
+    加载失败时返回 None,计数退化为按字节估算(/metrics 的 tokenizer.exact 为 false)。
+    """
+    global _tokenizer, _tokenizer_loaded
+    with _tokenizer_lock:
+        if not _tokenizer_loaded:
+            if settings.tiktoken_cache_dir:
+                os.environ["TIKTOKEN_CACHE_DIR"] = str(PROJECT_ROOT / settings.tiktoken_cache_dir)
+            try:
+                import tiktoken
+                _tokenizer = tiktoken.get_encoding(settings.tokenizer_encoding)
+            except Exception as e:
+                logger.warning("加载 tokenizer 失败,改用估算计数: %r", e)
+            _tokenizer_loaded = True
+    return _tokenizer
+
+
+def tokenizer_status() -> Dict[str, Any]:
+    """tokenizer 状态: exact 为 false 时 token 数为按字节估算的结果"""
+    return {
+        "encoding": settings.tokenizer_encoding,
+        "loaded": _tokenizer_loaded,
+        "exact": _tokenizer is not None,
+    }
+
+
+def count_tokens(text: str) -> int:
+    """
+    统计文本的 token 数
+
+    没有可用的 tokenizer 时按 UTF-8 字节数 / 4 估算
+    """
+    if not text:
+        return 0
+    # 启动阶段仍在加载(例如首次下载编码文件)时不阻塞事件循环,先按估算计数
+    tokenizer = _tokenizer if _tokenizer_lock.locked() else get_tokenizer()
+    if tokenizer is None:
+        return len(text.encode("utf-8")) // 4 + 1
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: List[BaseMessage]) -> int:
+    """统计一组对话消息的 token 数(包含消息格式开销)"""
+    total = TOKENS_PER_REPLY
+    for message in messages:
+        content = message.content
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        total += TOKENS_PER_MESSAGE + count_tokens(content)
+    return total
+
+
+def drop_nulls(data: Any) -> Any:
+    """递归删除字典中值为 None 的字段"""
+    if isinstance(data, dict):
+        return {k: drop_nulls(v) for k, v in data.items() if v is not None}
+    if isinstance(data, list):
+        return [drop_nulls(item) for item in data]
+    return data
+
+
+def compact_json(data: Any) -> str:
+    """
+    无损压缩的 JSON 文本: 删除 null 字段,去掉缩进和多余空白
+    """
+    return json.dumps(drop_nulls(data), ensure_ascii=False, separators=(",", ":"))
+
+
+def tabulate_records(records: List[dict]) -> dict:
+    """
+    将字段相同的记录列表转换为表格形式
+
+    字段名只在 columns 中出现一次,每条记录按列顺序存放在 rows 中,
+    避免每条记录重复字段名。
+
+    Returns:
+        {"columns": [...], "rows": [[...], ...]}
+    """
+    columns: List[str] = []
+    for record in records:
+        for key in record:
+            if key not in columns:
+                columns.append(key)
+    return {
+        "columns": columns,
+        "rows": [[record.get(column) for column in columns] for record in records]
+    }
+
+
+class TokenUsage:
+    """按路由汇总的 token 使用统计"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._routes: Dict[str, Dict[str, int]] = {}
+
+    def _route(self, route: str) -> Dict[str, int]:
+        return self._routes.setdefault(route, {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "max_prompt_tokens": 0,
+            "rejected": 0,
+            "provider_prompt_tokens": 0,
+            "cached_tokens": 0,
+        })
+
+    def record(
+        self,
+        route: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        provider_prompt_tokens: int = 0,
+        cached_tokens: int = 0
+    ):
+        """
+        记录一次大模型调用
+
+        Args:
+            route: 路由名称
+            prompt_tokens: 本地计数的提示词 token 数
+            completion_tokens: 本地计数的回复 token 数
+            provider_prompt_tokens: 服务商报告的提示词 token 数(未报告时为 0)
+            cached_tokens: 服务商报告的命中前缀缓存的 token 数
+        """
+        with self._lock:
+            stats = self._route(route)
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["max_prompt_tokens"] = max(stats["max_prompt_tokens"], prompt_tokens)
+            stats["provider_prompt_tokens"] += provider_prompt_tokens
+            stats["cached_tokens"] += cached_tokens
+
+    def record_rejected(self, route: str):
+        """记录一次因超出预算被拒绝的调用"""
+        with self._lock:
+            self._route(route)["rejected"] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        返回当前统计数据的副本
+
+        cached_token_ratio 为服务商报告的缓存命中 token 占比,服务商未报告用量时为 None
+        """
+        with self._lock:
+            result = {}
+            for route, stats in self._routes.items():
+                route_stats: Dict[str, Any] = dict(stats)
+                provider_prompt_tokens = stats["provider_prompt_tokens"]
+                route_stats["cached_token_ratio"] = (
+                    round(stats["cached_tokens"] / provider_prompt_tokens, 4)
+                    if provider_prompt_tokens else None
+                )
+                result[route] = route_stats
+            return result
+
+
+token_usage = TokenUsage()
+
+
+class TokenAccountingHandler(BaseCallbackHandler):
+    """
+    LangChain 回调: 调用大模型前检查提示词预算,调用结束后记录 token 使用量
+
+    每次调用创建一个实例,通过 config={"callbacks": [...]} 传入 chain。
+    """
+
+    # 让预算检查抛出的异常中断 chain,并在调用方的上下文中同步执行
+    raise_error = True
+    run_inline = True
+
+    def __init__(self, route: str, budget: Optional[int] = None):
+        self.route = route
+        self.budget = budget
+        self.prompt_tokens = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.prompt_tokens = sum(count_message_tokens(batch) for batch in messages)
+        if self.budget and self.prompt_tokens > self.budget:
+            token_usage.record_rejected(self.route)
+            raise TokenBudgetExceeded(self.route, self.prompt_tokens, self.budget)
+
+    def on_llm_end(self, response, **kwargs):
+        completion_text = ""
+        provider_prompt_tokens = 0
+        cached_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                completion_text += generation.text
+
+                # 服务商报告的用量 (OpenAI 兼容接口通过 prompt_tokens_details.cached_tokens 返回)
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if usage:
+                    provider_prompt_tokens += usage.get("input_tokens", 0)
+                    details = usage.get("input_token_details") or {}
+                    cached_tokens += details.get("cache_read") or 0
+
+        token_usage.record(
+            self.route,
+            self.prompt_tokens,
+            count_tokens(completion_text),
+            provider_prompt_tokens,
+            cached_tokens
+        )
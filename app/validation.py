@@ -0,0 +1,101 @@
+from typing import List, Optional
+
+from app.schemas import MissingFieldItem, MortgageFormData
+
+
+# 必填字段规则,与 /check-missing-fields 系统提示词中的校验规则保持一致
+# (字段名, 类型, 选项, 固定提示消息)
+REQUIRED_FIELDS = [
+    (
+        "mortgageType", "select", ["purchase", "refinance"],
+        "Are you looking to purchase a new home or refinance your current mortgage? "
+        "This helps us show you the right loan options."
+    ),
+    (
+        "zipCode", "input", None,
+        "What's the ZIP code of the property? Rates and loan limits vary by location."
+    ),
+    (
+        "purchasePrice", "input", None,
+        "What's the purchase price or estimated value of the home? "
+        "We use it to work out your loan amount."
+    ),
+    (
+        "downPayment", "input", None,
+        "How much are you planning to put down? "
+        "Your down payment affects both your rate and which programs you qualify for."
+    ),
+    (
+        "creditScore", "array", None,
+        "What's your approximate credit score range? "
+        "Higher scores often unlock better pricing tiers."
+    ),
+    (
+        "loanTerm", "input", None,
+        "How many years would you like your loan term to be? "
+        "Shorter terms usually come with lower rates."
+    ),
+    (
+        "armOrFixed", "select", ["fix", "arm"],
+        "Would you prefer a fixed rate or an adjustable rate (ARM)? "
+        "Each has its own advantages depending on your plans."
+    ),
+    (
+        "showFhaLoans", "boolean", None,
+        "Would you like to include FHA loans? "
+        "They can offer more flexible credit and down payment requirements."
+    ),
+    (
+        "showVaLoans", "boolean", None,
+        "Are you eligible for VA loans? "
+        "Veterans and service members can often get excellent terms."
+    ),
+]
+
+# 有固定取值范围的字段
+ALLOWED_VALUES = {
+    "mortgageType": {"purchase", "refinance"},
+    "armOrFixed": {"fix", "arm"},
+}
+
+
+def find_missing_fields(form_data: MortgageFormData) -> List[MissingFieldItem]:
+    """
+    按固定规则检查缺失的必填字段(不调用大模型)
+
+    - 数值字段: 0 是合法值,只有 null 或缺失才视为缺失
+    - 布尔字段: false 是合法值
+    - select 字段: 取值不在选项中同样视为缺失
+    - creditScore: [780, null] 或 [null, 600] 都是合法值,全部为 null 视为缺失
+
+    Args:
+        form_data: 房贷表单数据
+
+    Returns:
+        缺失字段列表,按固定的字段顺序排列
+    """
+    missing_fields = []
+
+    for key, field_type, options, message in REQUIRED_FIELDS:
+        value = getattr(form_data, key)
+        if not _is_missing(key, value):
+            continue
+        missing_fields.append(MissingFieldItem(
+            key=key,
+            message=message,
+            type=field_type,
+            options=options
+        ))
+
+    return missing_fields
+
+
+def _is_missing(key: str, value: Optional[object]) -> bool:
+    """判断单个字段的值是否视为缺失"""
+    if value is None:
+        return True
+    if key in ALLOWED_VALUES:
+        return str(value).lower() not in ALLOWED_VALUES[key]
+    if key == "creditScore":
+        return len(value) == 0 or all(score is None for score in value)
+    return False
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+请求解析微基准: 对比每个请求的解析、校验、序列化开销
+
+- 旧路径: json.loads -> Model(**dict) -> json.dumps(model.model_dump(), indent=2)
+- 新路径: Model.model_validate_json(bytes) -> model.model_dump_json(exclude_none=True)
+
+运行: python bench_schemas.py
+"""
+import json
+import timeit
+
+from app.schemas import LoanProductFilterRequest, MortgageFormData, loan_product_filter_adapter
+
+REQUEST_BODY = json.dumps({
+    "mortgageType": "refinance",
+    "zipCode": 90011,
+    "purchasePrice": 1310000,
+    "downPayment": 524000,
+    "creditScore": [780, 850],
+    "loanTerm": 30,
+    "armOrFixed": "fix",
+    "showFhaLoans": False,
+    "showVaLoans": False
+}).encode("utf-8")
+
+PARTIAL_BODY = json.dumps({
+    "zipCode": 90011,
+    "creditScore": [780, None]
+}).encode("utf-8")
+
+NUMBER = 20000
+
+
+def legacy_filter(body: bytes):
+    return LoanProductFilterRequest(**json.loads(body))
+
+
+def fast_filter(body: bytes):
+    return loan_product_filter_adapter.validate_json(body)
+
+
+def legacy_prompt(body: bytes):
+    form_data = MortgageFormData(**json.loads(body))
+    return json.dumps(form_data.model_dump(), indent=2)
+
+
+def fast_prompt(body: bytes):
+    form_data = MortgageFormData.model_validate_json(body)
+    return form_data.model_dump_json(exclude_none=True)
+
+
+def bench(name: str, func, body: bytes) -> float:
+    """运行基准并返回每次调用的微秒数"""
+    seconds = min(timeit.repeat(lambda: func(body), number=NUMBER, repeat=5))
+    per_call = seconds / NUMBER * 1e6
+    print(f"  {name:<32} {per_call:8.2f} µs/请求")
+    return per_call
+
+
+if __name__ == "__main__":
+    for label, body in [("完整表单", REQUEST_BODY), ("部分表单", PARTIAL_BODY)]:
+        print(f"\n=== {label} ({len(body)} 字节) ===")
+
+        print("/loan-products 筛选条件解析:")
+        legacy = bench("json.loads + Model(**data)", legacy_filter, body)
+        fast = bench("TypeAdapter.validate_json", fast_filter, body)
+        print(f"  加速比: {legacy / fast:.2f}x")
+
+        print("/check-missing-fields 解析 + 提示词序列化:")
+        legacy = bench("model_dump + json.dumps(indent=2)", legacy_prompt, body)
+        fast = bench("model_dump_json(exclude_none)", fast_prompt, body)
+        print(f"  加速比: {legacy / fast:.2f}x")
@@ -123,11 +123,94 @@ def test_combined_filters():
                   f"Rate: {p['rate']}%, Term: {p['term']}, Type: {p['arm_or_fixed']}")
 
 
+def test_best_products():
+    """测试各锁定期最优产品"""
+    print("\n=== 测试8: 各锁定期最优产品 (top 3) ===")
+    filters = {
+        "purchasePrice": 800000,
+        "downPayment": 200000,
+        "loanTerm": 30,
+        "armOrFixed": "fix"
+    }
+    response = requests.post(f"{BASE_URL}/loan-products/best", params={"topK": 3}, json=filters)
+    data = response.json()
+    print(f"贷款金额: {data['loanAmount']}")
+    
+    for period in data['lockPeriods']:
+        print(f"\n{period['lockDays']} 天锁定:")
+        costs = [item['effectiveCost'] for item in period['products']]
+        for i, item in enumerate(period['products'], 1):
+            p = item['product']
+            print(f"{i}. {p['name']} - Rate: {p['rate']}%, Price: {item['price']}, "
+                  f"有效成本: {item['effectiveCost']}")
+        print(f"按有效成本升序: {costs == sorted(costs)}")
+
+
+def test_balance_buckets_by_program():
+    """测试按贷款项目选择额度分类"""
+    print("\n=== 测试10: 按贷款项目选择额度分类 ===")
+    cases = [
+        # (说明, 邮编, 购买价格, 首付, 期望的 (program, balance_bucket) 集合)
+        ("洛杉矶 90 万贷款", 90011, 1000000, 100000,
+         {("CONV", "HIGH_BALANCE"), ("VA", "JUMBO"), ("FHA", "JUMBO")}),
+        ("达拉斯 90 万贷款 (超过地区额度)", 75001, 1000000, 100000,
+         {("CONV", "JUMBO")}),
+        ("洛杉矶 140 万贷款 (超过额度上限)", 90011, 1600000, 200000,
+         {("CONV", "JUMBO")}),
+        ("达拉斯 60 万贷款", 75001, 800000, 200000,
+         {("CONV", "STANDARD"), ("VA", "STANDARD"), ("FHA", "STANDARD"), ("USDA", "STANDARD")}),
+    ]
+    for label, zip_code, price, down, expected in cases:
+        filters = {
+            "zipCode": zip_code,
+            "purchasePrice": price,
+            "downPayment": down,
+            "showVaLoans": True,
+            "showFhaLoans": True
+        }
+        response = requests.post(f"{BASE_URL}/loan-products", json=filters)
+        data = response.json()
+        buckets = {(p['program'], p['balance_bucket']) for p in data['products']}
+        print(f"{label}: {sorted(buckets)}")
+        # 产品目录中没有 CONV JUMBO 产品,期望集合只作为上限
+        assert buckets <= expected, buckets
+        assert all(p['program'] in ("VA", "FHA") for p in data['products']
+                   if p['balance_bucket'] == "JUMBO"), buckets
+
+
+def test_best_products_dedup_across_lenders():
+    """测试相同产品在多个 lender 之间去重(不需要启动服务)"""
+    print("\n=== 测试9: 最优产品跨 lender 去重 ===")
+    from app.catalog import rank_best_products
+    from app.schemas import LoanProduct
+    
+    base = {
+        "name": "ELITE 21-30 YEAR", "program": "CONV", "tier": "ELITE",
+        "balance_bucket": "STANDARD", "construction_type": "EXISTING",
+        "arm_or_fixed": "FIXED", "term": "21-30",
+    }
+    products = [
+        LoanProduct(**base, rate=7.5, price_15_day=-3.0, price_30_day=-3.0, price_45_day=-3.0, lender="UWM"),
+        LoanProduct(**base, rate=7.25, price_15_day=-1.0, price_30_day=-1.0, price_45_day=-1.0, lender="ROCKET"),
+        LoanProduct(**base, rate=7.0, price_15_day=1.0, price_30_day=1.0, price_45_day=1.0, lender="PENNYMAC"),
+    ]
+    rankings = rank_best_products(products, loan_amount=600000, top_k=3)
+    
+    for period in rankings:
+        lenders = [item.product.lender for item in period.products]
+        print(f"{period.lockDays} 天锁定: {lenders}")
+        # 有效成本: UWM 34.5, ROCKET 35.25, PENNYMAC 36 -> 只保留 UWM
+        assert lenders == ["UWM"], lenders
+    print("相同产品只保留有效成本最低的 lender: True")
+
+
 if __name__ == "__main__":
     try:
         print("开始测试贷款产品筛选接口...")
         print("=" * 60)
         
+        # 不需要启动服务的检查先执行
+        test_best_products_dedup_across_lenders()
         test_no_filters()
         test_credit_score_elite()
         test_loan_term()
@@ -135,6 +218,8 @@ if __name__ == "__main__":
         test_show_va_loans()
         test_show_fha_loans()
         test_combined_filters()
+        test_best_products()
+        test_balance_buckets_by_program()
         
         print("\n" + "=" * 60)
         print("所有测试完成!")
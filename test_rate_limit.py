@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+测试按客户端限流
+"""
+import uuid
+
+import requests
+
+BASE_URL = "http://localhost:8000"
+
+# 产品目录接口的默认突发请求数 (RATE_LIMIT_CATALOG_BURST)
+CATALOG_BURST = 30
+
+
+def test_rotating_api_key():
+    """测试轮换未登记的 X-API-Key 无法绕过限流"""
+    print("\n=== 测试1: 每次请求使用不同的 X-API-Key ===")
+    status_codes = []
+    for _ in range(CATALOG_BURST + 5):
+        response = requests.post(
+            f"{BASE_URL}/loan-products",
+            json={},
+            headers={"X-API-Key": uuid.uuid4().hex}
+        )
+        status_codes.append(response.status_code)
+    
+    limited = status_codes.count(429)
+    print(f"请求数: {len(status_codes)}, 返回 429 的次数: {limited}")
+    print(f"轮换 API Key 仍被限流: {limited > 0}")
+    assert limited > 0, status_codes
+
+
+def test_rotating_forwarded_for():
+    """测试伪造 X-Forwarded-For 左侧地址无法绕过限流"""
+    print("\n=== 测试2: 每次请求在 X-Forwarded-For 左侧填写不同的地址 ===")
+    # 模拟一层反向代理: 客户端伪造的地址在左侧,代理追加的真实地址固定在最右侧
+    # (服务以 TRUST_PROXY_HEADERS=true 启动时才按该请求头识别,否则按连接地址识别)
+    status_codes = []
+    for i in range(CATALOG_BURST + 5):
+        response = requests.post(
+            f"{BASE_URL}/loan-products",
+            json={},
+            headers={"X-Forwarded-For": f"198.51.100.{i % 250}, 203.0.113.7"}
+        )
+        status_codes.append(response.status_code)
+    
+    limited = status_codes.count(429)
+    print(f"请求数: {len(status_codes)}, 返回 429 的次数: {limited}")
+    print(f"伪造 X-Forwarded-For 仍被限流: {limited > 0}")
+    assert limited > 0, status_codes
+
+
+if __name__ == "__main__":
+    try:
+        print("开始测试限流...")
+        print("=" * 60)
+        
+        test_rotating_api_key()
+        test_rotating_forwarded_for()
+        
+        print("\n" + "=" * 60)
+        print("所有测试完成!")
+        
+    except requests.exceptions.ConnectionError:
+        print("\n错误: 无法连接到服务器。请确保服务已启动:")
+        print("  uv run fastapi dev app/main.py --port 8000")